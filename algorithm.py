@@ -1,15 +1,101 @@
 import numpy as np
 
+from random_streams import child, generator, seed_sequence
+
+MEMORY_LIMIT = 2 ** 27
+
 
 def distance(x, y, p_norm=2):
     return np.sum(np.abs(x - y) ** p_norm) ** (1 / p_norm)
 
 
-def sample_inside_sphere(dimensionality, radius, p_norm=2):
-    direction_unit_vector = (2 * np.random.rand(dimensionality) - 1)
+def pairwise_distances(X, Y, p_norm=2, memory_limit=MEMORY_LIMIT):
+    X = np.asarray(X)
+    Y = np.asarray(Y)
+
+    result = np.zeros((len(X), len(Y)))
+
+    if len(X) == 0 or len(Y) == 0:
+        return result
+
+    # the (rows, columns, features) difference tensor is the only large temporary,
+    # so both dimensions of the block are bounded to keep it under memory_limit bytes
+    cell_size = X.shape[1] * np.result_type(X, Y).itemsize
+    block_columns = int(np.clip(memory_limit // max(cell_size, 1), 1, len(Y)))
+    block_rows = int(np.clip(memory_limit // max(cell_size * block_columns, 1), 1, len(X)))
+
+    for i in range(0, len(X), block_rows):
+        for j in range(0, len(Y), block_columns):
+            difference = X[i:(i + block_rows), np.newaxis, :] - Y[np.newaxis, j:(j + block_columns), :]
+            np.abs(difference, out=difference)
+
+            if p_norm == 1:
+                block = np.sum(difference, axis=2)
+            elif p_norm == 2:
+                # sqrt is correctly rounded, while the ** (1 / 2) of distance() goes through pow, so the two can
+                # disagree in the last ulp on a small fraction of the distances
+                np.square(difference, out=difference)
+                block = np.sqrt(np.sum(difference, axis=2))
+            else:
+                block = np.sum(difference ** p_norm, axis=2) ** (1 / p_norm)
+
+            result[i:(i + block_rows), j:(j + block_columns)] = block
+
+    return result
+
+
+def sample_inside_sphere(dimensionality, radius, p_norm=2, rng=None):
+    rng = np.random.default_rng() if rng is None else rng
+
+    direction_unit_vector = (2 * rng.random(dimensionality) - 1)
     direction_unit_vector = direction_unit_vector / distance(direction_unit_vector, np.zeros(dimensionality), p_norm)
 
-    return direction_unit_vector * np.random.rand() * radius
+    return direction_unit_vector * rng.random() * radius
+
+
+def sample_inside_spheres(dimensionality, radii, p_norm=2, rng=None):
+    rng = np.random.default_rng() if rng is None else rng
+    radii = np.asarray(radii, dtype=np.float64)
+
+    direction_unit_vectors = (2 * rng.random((len(radii), dimensionality)) - 1)
+    direction_unit_vectors /= pairwise_distances(direction_unit_vectors, np.zeros((1, dimensionality)), p_norm)
+
+    return direction_unit_vectors * (rng.random(len(radii)) * radii)[:, np.newaxis]
+
+
+def draw_selections(pool_sizes, n_selected, rng=None):
+    rng = np.random.default_rng() if rng is None else rng
+    pool_sizes = np.maximum(np.asarray(pool_sizes, dtype=int), 0)
+    n_selected = np.maximum(np.asarray(n_selected, dtype=int), 0)
+
+    pool_offsets = np.cumsum(pool_sizes) - pool_sizes
+    output_offsets = np.cumsum(n_selected) - n_selected
+    replace = n_selected > pool_sizes
+
+    # a single uniform draw supplies one value per selection from the pools sampled with replacement
+    # and one random key per entry of the pools sampled without it
+    n_draws = np.where(replace, n_selected, pool_sizes)
+    draws = rng.random(np.sum(n_draws))
+    pools = np.repeat(np.arange(len(pool_sizes)), n_draws)
+    positions = np.arange(len(draws)) - np.repeat(np.cumsum(n_draws) - n_draws, n_draws)
+
+    result = np.empty(np.sum(n_selected), dtype=int)
+
+    with_replacement = replace[pools]
+    entries = np.minimum((draws * pool_sizes[pools]).astype(int), pool_sizes[pools] - 1)
+    result[(output_offsets[pools] + positions)[with_replacement]] = (pool_offsets[pools] + entries)[with_replacement]
+
+    # without replacement, the entries of a pool with the smallest keys are selected, in the order of their keys;
+    # sorting within pools keeps every pool in place, so the rank of a sorted entry is the position it replaced
+    unsorted = np.flatnonzero(~with_replacement)
+    keyed = unsorted[np.lexsort((draws[unsorted], pools[unsorted]))]
+    ranks = positions[unsorted]
+    selected = ranks < n_selected[pools[keyed]]
+    keyed = keyed[selected]
+
+    result[output_offsets[pools[keyed]] + ranks[selected]] = pool_offsets[pools[keyed]] + positions[keyed]
+
+    return result
 
 
 def rbf(d, gamma):
@@ -28,10 +114,109 @@ def rbf_score(point, minority_points, gamma, p_norm=2):
     return result
 
 
+def rbf_scores(points, minority_points, gamma, p_norm=2, dtype=None, block_size=None, memory_limit=MEMORY_LIMIT):
+    points = np.asarray(points)
+    minority_points = np.asarray(minority_points)
+
+    if dtype is None:
+        dtype = np.result_type(points, minority_points)
+
+    result = np.zeros(len(points), dtype=dtype)
+
+    if gamma == 0.0 or len(points) == 0 or len(minority_points) == 0:
+        return result
+
+    if block_size is None:
+        block_size = max(1, memory_limit // (len(minority_points) * np.dtype(dtype).itemsize))
+
+    for i in range(0, len(points), block_size):
+        d = pairwise_distances(minority_points, points[i:(i + block_size)], p_norm, memory_limit).astype(dtype)
+        d /= gamma
+        np.square(d, out=d)
+        np.negative(d, out=d)
+        np.exp(d, out=d)
+
+        # accumulating one minority point at a time keeps the summation order of rbf_score(), so the scores only
+        # differ from it through the last-ulp differences of pairwise_distances()
+        for row in d:
+            result[i:(i + block_size)] += row
+
+    return result
+
+
+def sort_neighbors(distances, k):
+    n_majority = distances.shape[1]
+
+    if k == 0:
+        return np.zeros((len(distances), 0), dtype=int)
+    elif k < n_majority:
+        candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(n_majority), (len(distances), 1))
+
+    return np.take_along_axis(candidates, np.argsort(np.take_along_axis(distances, candidates, 1), axis=1), 1)
+
+
+def compute_radii(distances, energy, n_neighbors=64, order=None):
+    n_minority, n_majority = distances.shape
+
+    radii = np.zeros(n_minority)
+    n_engulfed = np.zeros(n_minority, dtype=int)
+    chunks = []
+
+    unresolved = np.arange(n_minority)
+    k = min(n_majority, n_neighbors)
+
+    # energy is spent on the nearest majority points first, so only the k nearest distances are sorted;
+    # seeds that engulf all k of them without running out of energy are retried with four times as many
+    while len(unresolved) > 0:
+        rows = distances[unresolved]
+
+        if order is not None and k <= order.shape[1]:
+            rows_order = order[unresolved, :k]
+        else:
+            rows_order = sort_neighbors(rows, k)
+
+        sorted_distances = np.take_along_axis(rows, rows_order, 1)
+
+        # running sums replay the radius increments and energy decrements of the sequential
+        # formulation in the same order, so the results are identical to stepping point by point
+        radius_changes = np.diff(sorted_distances, axis=1, prepend=0.0)
+        radius = np.cumsum(np.concatenate([np.zeros((len(unresolved), 1)), radius_changes], 1), 1)
+        remaining_energy = np.cumsum(np.concatenate([
+            np.full((len(unresolved), 1), float(energy)), -radius_changes * np.arange(1, k + 1)
+        ], 1), 1)
+
+        stop = sorted_distances >= radius[:, :-1] + remaining_energy[:, :-1] / np.arange(1, k + 1)
+        stopped = np.any(stop, axis=1)
+        resolved = stopped | (k == n_majority)
+
+        # without majority points there is nothing to engulf, and argmax is undefined on the empty rows
+        n = np.where(stopped, np.argmax(stop, axis=1) if k > 0 else 0, k)[resolved]
+        divisor = np.where(n == n_majority, np.maximum(n, 1), n + 1)
+        resolved_rows = unresolved[resolved]
+
+        radii[resolved_rows] = radius[resolved, n] + remaining_energy[resolved, n] / divisor
+        n_engulfed[resolved_rows] = n
+        chunks.append((resolved_rows, rows_order[resolved]))
+
+        unresolved = unresolved[~resolved]
+        k = min(n_majority, 4 * k)
+
+    neighbors = np.zeros((n_minority, np.max(n_engulfed, initial=0)), dtype=int)
+
+    for rows, rows_order in chunks:
+        width = min(rows_order.shape[1], neighbors.shape[1])
+        neighbors[rows, :width] = rows_order[:, :width]
+
+    return radii, n_engulfed, neighbors
+
+
 class RBCCR:
     def __init__(self, energy, gamma=1.0, n_samples=100, threshold=0.33,
                  regions='E', p_norm=2, minority_class=None, n=None,
-                 random_state=None, keep_appended=False, keep_radii=False):
+                 random_state=None, keep_appended=False, keep_radii=False,
+                 memory_limit=MEMORY_LIMIT, score_dtype=None, block_size=None):
         self.energy = energy
         self.gamma = gamma
         self.n_samples = n_samples
@@ -43,13 +228,17 @@ class RBCCR:
         self.random_state = random_state
         self.keep_appended = keep_appended
         self.keep_radii = keep_radii
+        self.memory_limit = memory_limit
+        self.score_dtype = score_dtype
+        self.block_size = block_size
 
         self.appended = None
         self.radii = None
 
     def fit_sample(self, X, y):
-        np.random.seed(self.random_state)
+        return next(self.fit_sample_path(X, y, [self.energy]))
 
+    def prepare(self, X, y):
         if self.minority_class is None:
             classes = np.unique(y)
             sizes = [sum(y == c) for c in classes]
@@ -62,127 +251,125 @@ class RBCCR:
         minority_labels = y[y == minority_class].copy()
         majority_labels = y[y != minority_class].copy()
 
-        if self.n is None:
-            n = len(majority_points) - len(minority_points)
-        else:
-            n = self.n
-
-        distances = np.zeros((len(minority_points), len(majority_points)))
-
-        for i in range(len(minority_points)):
-            for j in range(len(majority_points)):
-                distances[i][j] = distance(minority_points[i], majority_points[j], self.p_norm)
-
-        radii = np.zeros(len(minority_points))
-
-        translations = np.zeros(majority_points.shape)
-
-        for i in range(len(minority_points)):
-            minority_point = minority_points[i]
-            remaining_energy = self.energy
-            radius = 0.0
-            sorted_distances = np.argsort(distances[i])
-            n_majority_points_within_radius = 0
+        distances = pairwise_distances(minority_points, majority_points, self.p_norm, self.memory_limit)
 
-            while True:
-                if n_majority_points_within_radius == len(majority_points):
-                    if n_majority_points_within_radius == 0:
-                        radius_change = remaining_energy / (n_majority_points_within_radius + 1)
-                    else:
-                        radius_change = remaining_energy / n_majority_points_within_radius
+        return minority_class, minority_points, majority_points, minority_labels, majority_labels, distances
 
-                    radius += radius_change
+    def preparation_key(self):
+        return type(self).__name__, self.p_norm, self.minority_class
 
-                    break
+    def fit_sample_path(self, X, y, energies, prepared=None):
+        if prepared is None:
+            prepared = self.prepare(X, y)
 
-                radius_change = remaining_energy / (n_majority_points_within_radius + 1)
+        minority_class, minority_points, majority_points, minority_labels, majority_labels, distances = prepared
 
-                if distances[i, sorted_distances[n_majority_points_within_radius]] >= radius + radius_change:
-                    radius += radius_change
+        order = None
 
-                    break
-                else:
-                    if n_majority_points_within_radius == 0:
-                        last_distance = 0.0
-                    else:
-                        last_distance = distances[i, sorted_distances[n_majority_points_within_radius - 1]]
+        # the streams are resolved once, so every energy of the path draws the same numbers as a single fit
+        random_state = seed_sequence(self.random_state)
 
-                    radius_change = distances[i, sorted_distances[n_majority_points_within_radius]] - last_distance
-                    radius += radius_change
-                    remaining_energy -= radius_change * (n_majority_points_within_radius + 1)
-                    n_majority_points_within_radius += 1
+        if len(energies) > 1:
+            # radii grow with the energy, so the points engulfed at the largest energy, together with the
+            # point that stops the growth, form a sorted prefix that every smaller energy can reuse
+            _, n_engulfed, _ = compute_radii(distances, np.max(energies))
+            order = sort_neighbors(distances, min(len(majority_points), np.max(n_engulfed, initial=0) + 1))
 
-            radii[i] = radius
+        for energy in energies:
+            yield self._fit_sample(energy, minority_class, minority_points, majority_points.copy(),
+                                   minority_labels, majority_labels, distances, order, random_state)
 
-            for j in range(n_majority_points_within_radius):
-                majority_point = majority_points[sorted_distances[j]]
-                d = distances[i, sorted_distances[j]]
-
-                while d < 1e-20:
-                    majority_point += (1e-6 * np.random.rand(len(majority_point)) + 1e-6) * \
-                                      np.random.choice([-1.0, 1.0], len(majority_point))
-                    d = distance(minority_point, majority_point)
-
-                translation = (radius - d) / d * (majority_point - minority_point)
-                translations[sorted_distances[j]] += translation
-
-        if self.keep_radii:
-            self.radii = radii
+    def _fit_sample(self, energy, minority_class, minority_points, majority_points,
+                    minority_labels, majority_labels, distances, order=None, random_state=None):
+        # independent streams for the jittering, the sampling of candidates and their selection, the first
+        # being split further into one stream per seed
+        jitter_state = child(random_state, 0)
+        jitter_rngs = {}
+        sampling_rng = generator(random_state, 1)
+        selection_rng = generator(random_state, 2)
 
-        appended = []
-
-        for i in range(len(minority_points)):
-            minority_point = minority_points[i]
-            n_synthetic_samples = int(np.round(1.0 / (radii[i] * np.sum(1.0 / radii)) * n))
-            r = radii[i]
+        if self.n is None:
+            n = len(majority_points) - len(minority_points)
+        else:
+            n = self.n
 
-            if self.gamma is None or ('L' in self.regions and 'E' in self.regions and 'H' in self.regions):
-                for _ in range(n_synthetic_samples):
-                    appended.append(minority_point + sample_inside_sphere(len(minority_point), r, self.p_norm))
-            else:
-                samples = []
-                scores = []
+        radii, n_engulfed, neighbors = compute_radii(distances, energy, order=order)
 
-                for _ in range(self.n_samples):
-                    sample = minority_point + sample_inside_sphere(len(minority_point), r, self.p_norm)
-                    score = rbf_score(sample, minority_points, self.gamma, self.p_norm)
+        translations = np.zeros(majority_points.shape)
 
-                    samples.append(sample)
-                    scores.append(score)
+        seeds, positions = np.nonzero(np.arange(neighbors.shape[1]) < n_engulfed[:, np.newaxis])
+        engulfed = neighbors[seeds, positions]
+        d = distances[seeds, engulfed]
 
-                seed_score = rbf_score(minority_point, minority_points, self.gamma, self.p_norm)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pair_translations = ((radii[seeds] - d) / d)[:, np.newaxis] * \
+                                (majority_points[engulfed] - minority_points[seeds])
 
-                lower_threshold = seed_score - self.threshold * (seed_score - np.min(scores + [seed_score]))
-                higher_threshold = seed_score + self.threshold * (np.max(scores + [seed_score]) - seed_score)
+            # majority points coinciding with their seed are jittered away from it in seed order,
+            # and every later translation of a jittered point is recomputed from its new position
+            for k in np.flatnonzero(d < 1e-20):
+                majority_point = majority_points[engulfed[k]]
+                minority_point = minority_points[seeds[k]]
 
-                suitable_samples = [minority_point]
+                if seeds[k] not in jitter_rngs:
+                    jitter_rngs[seeds[k]] = generator(jitter_state, seeds[k])
 
-                for sample, score in zip(samples, scores):
-                    if score <= lower_threshold:
-                        case = 'L'
-                    elif score >= higher_threshold:
-                        case = 'H'
-                    else:
-                        case = 'E'
+                rng = jitter_rngs[seeds[k]]
 
-                    if case in self.regions:
-                        suitable_samples.append(sample)
+                while d[k] < 1e-20:
+                    majority_point += (1e-6 * rng.random(len(majority_point)) + 1e-6) * \
+                                      rng.choice([-1.0, 1.0], len(majority_point))
+                    d[k] = distance(minority_point, majority_point)
 
-                suitable_samples = np.array(suitable_samples)
+                affected = k + np.flatnonzero(engulfed[k:] == engulfed[k])
+                pair_translations[affected] = ((radii[seeds[affected]] - d[affected]) / d[affected])[:, np.newaxis] * \
+                                              (majority_point - minority_points[seeds[affected]])
 
-                if n_synthetic_samples <= len(suitable_samples):
-                    replace = False
-                else:
-                    replace = True
+        np.add.at(translations, engulfed, pair_translations)
 
-                selected_samples = suitable_samples[
-                    np.random.choice(len(suitable_samples), n_synthetic_samples, replace=replace)
-                ]
+        if self.keep_radii:
+            self.radii = radii
 
-                for sample in selected_samples:
-                    appended.append(sample)
+        # a negative n, possible with an explicit minority_class or n, produces no samples
+        n_synthetic_samples = np.maximum(np.round(1.0 / (radii * np.sum(1.0 / radii)) * n).astype(int), 0)
 
-        appended = np.array(appended)
+        if self.gamma is None or ('L' in self.regions and 'E' in self.regions and 'H' in self.regions):
+            appended = np.repeat(minority_points, n_synthetic_samples, axis=0) + sample_inside_spheres(
+                minority_points.shape[1], np.repeat(radii, n_synthetic_samples), self.p_norm, sampling_rng
+            )
+        else:
+            seed_scores = rbf_scores(minority_points, minority_points, self.gamma, self.p_norm,
+                                     self.score_dtype, self.block_size, self.memory_limit)
+
+            n_minority, n_dimensions = minority_points.shape
+
+            # every seed proposes n_samples candidates, preceded by the seed itself, which is always suitable
+            candidates = np.empty((n_minority, self.n_samples + 1, n_dimensions))
+            candidates[:, 0] = minority_points
+            candidates[:, 1:] = minority_points[:, np.newaxis] + sample_inside_spheres(
+                n_dimensions, np.repeat(radii, self.n_samples), self.p_norm, sampling_rng
+            ).reshape(n_minority, self.n_samples, n_dimensions)
+
+            scores = rbf_scores(candidates[:, 1:].reshape(-1, n_dimensions), minority_points, self.gamma,
+                                self.p_norm, self.score_dtype, self.block_size,
+                                self.memory_limit).reshape(n_minority, self.n_samples)
+
+            lowest_scores = np.minimum(np.min(scores, axis=1, initial=np.inf), seed_scores)
+            highest_scores = np.maximum(np.max(scores, axis=1, initial=-np.inf), seed_scores)
+            lower_thresholds = seed_scores - self.threshold * (seed_scores - lowest_scores)
+            higher_thresholds = seed_scores + self.threshold * (highest_scores - seed_scores)
+
+            # candidates are classified as in the sequential formulation, the lower threshold taking precedence
+            low = scores <= lower_thresholds[:, np.newaxis]
+            high = ~low & (scores >= higher_thresholds[:, np.newaxis])
+            equal = ~low & ~high
+
+            suitable = np.ones((n_minority, self.n_samples + 1), dtype=bool)
+            suitable[:, 1:] = (low & ('L' in self.regions)) | (high & ('H' in self.regions)) | \
+                              (equal & ('E' in self.regions))
+
+            selected = draw_selections(np.sum(suitable, axis=1), n_synthetic_samples, selection_rng)
+            appended = candidates[suitable][selected]
 
         if self.keep_appended:
             self.appended = appended
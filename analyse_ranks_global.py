@@ -2,32 +2,38 @@ import datasets
 import numpy as np
 import pandas as pd
 
-from merge import RESULTS_PATH
+from results_cube import load_cube
 
 
 def get_data(metric):
-    df = pd.read_csv(RESULTS_PATH / 'results_final.csv')
-    df = df[~df['Metric'].isin(['Precision', 'Recall', 'Specificity'])]
-    df = df[~df['Resampler'].isin(['CCR', 'RB-CCR-L', 'RB-CCR-E', 'RB-CCR-H'])]
-    df['Resampler'] = df['Resampler'].replace({'RB-CCR-CV': 'RB-CCR'})
-    df['Method'] = df.apply(lambda x: f'({x["Resampler"]}, {x["Classifier"]})', axis=1)
-    df = df.drop(['Classifier', 'Resampler'], axis=1)
-
-    methods = list(df['Method'].unique())
-    columns = ['Dataset'] + methods
-    rows = []
+    cube = load_cube()
+
+    classifiers = cube.labels['Classifier']
+    resamplers = [r for r in cube.labels['Resampler'] if r not in ['CCR', 'RB-CCR-L', 'RB-CCR-E', 'RB-CCR-H']]
+    metrics = [m for m in cube.labels['Metric'] if m not in ['Precision', 'Recall', 'Specificity']]
+
+    # methods are listed in the order in which they first appear in the results
+    first_rows = cube.select(cube.rows, Classifier=classifiers, Resampler=resamplers, Metric=metrics)
+    first_rows = first_rows.min(axis=(0, 1, 4))
+    pairs = [(c, r) for r in range(len(resamplers)) for c in range(len(classifiers))
+             if first_rows[c, r] < np.iinfo(np.int64).max]
+    pairs = sorted(pairs, key=lambda pair: first_rows[pair])
 
-    for dataset in datasets.names():
-        row = [dataset]
+    names = {'RB-CCR-CV': 'RB-CCR'}
+    methods = [f'({names.get(resamplers[r], resamplers[r])}, {classifiers[c]})' for c, r in pairs]
 
-        for method in methods:
-            ds = df[(df['Method'] == method) & (df['Dataset'] == dataset) & (df['Metric'] == metric)]['Score']
+    scores = cube.select(Dataset=datasets.names(), Classifier=classifiers, Resampler=resamplers, Metric=metric)
 
-            assert len(ds) == 10
+    assert scores.shape[1] == 10 and not np.any(np.isnan(scores[:, :, [c for c, _ in pairs], [r for _, r in pairs]]))
 
-            row.append(np.round(list(ds)[0], 4))
+    first_scores = cube.first('Fold', Dataset=datasets.names(), Classifier=classifiers, Resampler=resamplers,
+                              Metric=metric)
+
+    columns = ['Dataset'] + methods
+    rows = []
 
-        rows.append(row)
+    for k, dataset in enumerate(datasets.names()):
+        rows.append([dataset] + [np.round(first_scores[k, c, r], 4) for c, r in pairs])
 
     return pd.DataFrame(rows, columns=columns)
 
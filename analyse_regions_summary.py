@@ -1,10 +1,5 @@
-import numpy as np
-import pandas as pd
-
-from collections import OrderedDict
-from merge import RESULTS_PATH
-from rpy2.robjects import pandas2ri, r
-from rpy2.robjects.packages import importr
+from rank_tests import test_friedman_shaffer_many
+from results_cube import mean_scores
 
 
 RESAMPLERS = ['CCR', 'RB-CCR-L', 'RB-CCR-E', 'RB-CCR-H']
@@ -13,66 +8,19 @@ METRICS = ['Precision', 'Recall', 'Specificity', 'AUC', 'F-measure', 'G-mean']
 P_VALUE = 0.10
 
 
-def test_friedman_shaffer(dictionary):
-    df = pd.DataFrame(dictionary)
-
-    columns = df.columns
-
-    pandas2ri.activate()
-
-    importr('scmamp')
-
-    rFriedmanTest = r['friedmanTest']
-    rPostHocTest = r['postHocTest']
-
-    initial_results = rFriedmanTest(df)
-    posthoc_results = rPostHocTest(df, test='friedman', correct='shaffer', use_rank=True)
-
-    ranks = np.array(posthoc_results[0])[0]
-    p_value = initial_results[2][0]
-    corrected_p_values = np.array(posthoc_results[2])
-
-    ranks_dict = {col: rank for col, rank in zip(columns, ranks)}
-    corrected_p_values_dict = {}
-
-    for outer_col, corr_p_val_vect in zip(columns, corrected_p_values):
-        corrected_p_values_dict[outer_col] = {}
-
-        for inner_col, corr_p_val in zip(columns, corr_p_val_vect):
-            corrected_p_values_dict[outer_col][inner_col] = corr_p_val
-
-    return ranks_dict, p_value, corrected_p_values_dict
-
-
 def load_final_dict(classifier, metric):
-    df = pd.read_csv(RESULTS_PATH / 'results_final.csv')
-    df = df[(df['Classifier'] == classifier) & (df['Metric'] == metric)]
-
-    measurements = OrderedDict()
-
-    datasets = df['Dataset'].unique()
-
-    for resampler in RESAMPLERS:
-        measurements[resampler] = []
-
-        for dataset in datasets:
-            scores = df[(df['Resampler'] == resampler) & (df['Dataset'] == dataset)]['Score']
-
-            assert len(scores) == 10, len(scores)
-
-            measurements[resampler].append(np.mean(scores))
-
-    return measurements
+    return mean_scores(classifier, metric, RESAMPLERS)
 
 
 if __name__ == '__main__':
+    keys = [(classifier_name, metric) for classifier_name in CLASSIFIERS for metric in METRICS]
+    tests = dict(zip(keys, test_friedman_shaffer_many(load_final_dict(*key) for key in keys)))
+
     for classifier_name in CLASSIFIERS:
         line = [classifier_name]
 
         for metric in METRICS:
-            d = load_final_dict(classifier_name, metric)
-
-            ranks_dict, p_value, corrected_p_values_dict = test_friedman_shaffer(d)
+            ranks_dict, p_value, corrected_p_values_dict = tests[(classifier_name, metric)]
 
             min_key = min(ranks_dict, key=ranks_dict.get)
             max_key = max(ranks_dict, key=ranks_dict.get)
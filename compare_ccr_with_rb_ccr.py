@@ -1,9 +1,7 @@
 import datasets
 import numpy as np
-import pandas as pd
 
-from collections import OrderedDict
-from merge import RESULTS_PATH
+from results_cube import mean_scores
 from scipy.stats import wilcoxon
 
 
@@ -14,24 +12,7 @@ P_VALUE = 0.10
 
 
 def load_final_dict(classifier, metric):
-    csv_path = RESULTS_PATH / 'results_final.csv'
-
-    df = pd.read_csv(csv_path)
-    df = df[(df['Classifier'] == classifier) & (df['Metric'] == metric)]
-
-    measurements = OrderedDict()
-
-    for algorithm in ALGORITHMS:
-        measurements[algorithm] = []
-
-        for dataset in datasets.names():
-            scores = df[(df['Resampler'] == algorithm) & (df['Dataset'] == dataset)]['Score']
-
-            assert len(scores) == 10
-
-            measurements[algorithm].append(np.mean(scores))
-
-    return measurements
+    return mean_scores(classifier, metric, ALGORITHMS, datasets.names())
 
 
 if __name__ == '__main__':
@@ -1,9 +1,8 @@
 import datasets
 import numpy as np
-import pandas as pd
 
 from collections import OrderedDict
-from merge import RESULTS_PATH
+from results_cube import fold_scores
 from scipy.stats import wilcoxon
 
 
@@ -14,36 +13,11 @@ P_VALUE = 0.10
 
 
 def load_final_dict(classifier, metric):
-    csv_path = RESULTS_PATH / 'results_final.csv'
-
-    df = pd.read_csv(csv_path)
-    df = df[(df['Classifier'] == classifier) & (df['Metric'] == metric)]
+    scores = fold_scores(classifier, metric, ['CCR', 'RB-CCR-L', 'RB-CCR-E', 'RB-CCR-H'], datasets.names())
 
     measurements = OrderedDict()
-
-    for algorithm in ALGORITHMS:
-        measurements[algorithm] = []
-
-        for dataset in datasets.names():
-            fold_scores = []
-
-            for fold in range(10):
-                ds = df[(df['Dataset'] == dataset) & (df['Fold'] == fold)]
-
-                if algorithm == 'CCR':
-                    scores = ds[ds['Resampler'] == algorithm]['Score']
-
-                    assert len(scores) == 1
-
-                    fold_scores.append(scores.iloc[0])
-                else:
-                    scores = ds[ds['Resampler'].isin(['RB-CCR-L', 'RB-CCR-E', 'RB-CCR-H'])]['Score']
-
-                    assert len(scores) == 3
-
-                    fold_scores.append(scores.max())
-
-            measurements[algorithm].append(np.mean(fold_scores))
+    measurements['CCR'] = list(np.mean(scores[:, :, 0], axis=1))
+    measurements['RB-CCR-Best'] = list(np.mean(np.max(scores[:, :, 1:], axis=2), axis=1))
 
     return measurements
 
@@ -1,9 +1,7 @@
 import numpy as np
-import pandas as pd
 
-from analyse_regions import test_friedman_shaffer
-from collections import OrderedDict
-from merge import RESULTS_PATH
+from rank_tests import test_friedman_shaffer_many
+from results_cube import mean_scores
 
 
 RESAMPLERS = ['None', 'SMOTE', 'Bord', 'NCL', 'SMOTE+TL', 'SMOTE+EN', 'RB-CCR-CV']
@@ -13,27 +11,13 @@ P_VALUE = 0.10
 
 
 def load_final_dict(classifier, metric):
-    df = pd.read_csv(RESULTS_PATH / 'results_final.csv')
-    df = df[(df['Classifier'] == classifier) & (df['Metric'] == metric)]
-
-    measurements = OrderedDict()
-
-    datasets = df['Dataset'].unique()
-
-    for resampler in RESAMPLERS:
-        measurements[resampler] = []
-
-        for dataset in datasets:
-            scores = df[(df['Resampler'] == resampler) & (df['Dataset'] == dataset)]['Score']
-
-            assert len(scores) == 10, len(scores)
-
-            measurements[resampler].append(np.mean(scores))
-
-    return measurements
+    return mean_scores(classifier, metric, RESAMPLERS)
 
 
 if __name__ == '__main__':
+    keys = [(classifier, metric) for classifier in CLASSIFIERS for metric in METRICS]
+    tests = dict(zip(keys, test_friedman_shaffer_many(load_final_dict(*key) for key in keys)))
+
     for classifier in CLASSIFIERS:
         for metric in METRICS:
             if metric == METRICS[0]:
@@ -41,8 +25,7 @@ if __name__ == '__main__':
             else:
                 start = ''
 
-            d = load_final_dict(classifier, metric)
-            ranks, _, corrected_p_values = test_friedman_shaffer(d)
+            ranks, _, corrected_p_values = tests[(classifier, metric)]
 
             row = [start, metric]
 
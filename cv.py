@@ -1,59 +1,306 @@
+import hashlib
 import numpy as np
+import os
+import tempfile
 
-from itertools import product
+from collections import OrderedDict
+from itertools import chain, product
+from joblib import Parallel, delayed
 from metrics import auc
+from random_streams import child, seed_sequence
+from sklearn.base import clone
 from sklearn.model_selection import StratifiedKFold
 
 
+def fingerprint(X, y):
+    digest = hashlib.sha1()
+
+    for array in [X, y]:
+        array = np.ascontiguousarray(array)
+
+        digest.update(str((array.shape, array.dtype.str)).encode())
+        digest.update(array.tobytes())
+
+    return digest.hexdigest()
+
+
+def nbytes(splits):
+    values = chain.from_iterable(chain(split.values(), *split['structures'].values()) for split in splits)
+
+    return sum(value.nbytes for value in values if isinstance(value, np.ndarray))
+
+
+class SplitCache:
+    def __init__(self, max_bytes=2 ** 30):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+
+    def splits(self, X, y, seed):
+        key = (fingerprint(X, y), seed)
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        else:
+            self.entries[key] = _split(X, y, seed)
+
+            self.shrink()
+
+        return self.entries[key]
+
+    def shrink(self):
+        # entries grow as structures are prepared for their splits, so the budget is enforced again after every
+        # preparation; the most recently used entry is always kept
+        while len(self.entries) > 1 and sum(nbytes(splits) for splits in self.entries.values()) > self.max_bytes:
+            self.entries.popitem(last=False)
+
+
+SPLIT_CACHE = SplitCache()
+
+
+def _split(X, y, seed):
+    splits = []
+
+    for train_idx, test_idx in StratifiedKFold(n_splits=2, shuffle=True, random_state=seed).split(X, y):
+        split = {
+            'train_idx': train_idx, 'test_idx': test_idx,
+            'X_train': X[train_idx], 'y_train': y[train_idx],
+            'X_test': X[test_idx], 'y_test': y[test_idx],
+            'structures': {}
+        }
+
+        for key in ['train_idx', 'test_idx', 'X_train', 'y_train', 'X_test', 'y_test']:
+            split[key].flags.writeable = False
+
+        splits.append(split)
+
+    return splits
+
+
+def _split_seeds(seed, n):
+    if seed is None or isinstance(seed, (np.random.SeedSequence, np.random.Generator)):
+        state = seed_sequence(seed)
+
+        return [int(child(state, i).generate_state(1)[0]) for i in range(n)]
+
+    return [seed + i for i in range(n)]
+
+
+def _split_parameters(parameters, j):
+    # resamplers seeded with a SeedSequence draw from an independent child stream on every split, so the
+    # scores do not depend on the order in which the splits are evaluated, or on the worker evaluating them
+    if isinstance(parameters.get('random_state'), np.random.SeedSequence):
+        return dict(parameters, random_state=child(parameters['random_state'], j))
+
+    return parameters
+
+
+def _preparation_key(algorithm, parameters):
+    if not hasattr(algorithm, 'preparation_key'):
+        return None
+
+    return algorithm(**parameters).preparation_key()
+
+
+def _prepare(algorithm, parameters, X, y):
+    return algorithm(**parameters).prepare(X, y)
+
+
+def _share(prepared, folder):
+    shared = []
+
+    # large arrays are written once to memory-mapped files, which joblib passes to the workers by reference
+    # instead of pickling them into every task
+    for k, value in enumerate(prepared):
+        if isinstance(value, np.ndarray) and value.nbytes >= 2 ** 20:
+            path = os.path.join(folder, f'{id(prepared)}_{k}.npy')
+            np.save(path, value)
+            value = np.load(path, mmap_mode='r')
+
+        shared.append(value)
+
+    return tuple(shared)
+
+
+def _resample(algorithm, group, X, y, prepared=None):
+    results = []
+
+    while len(results) < len(group):
+        remaining = group[len(results):]
+
+        try:
+            if hasattr(algorithm, 'fit_sample_path') and 'energy' in remaining[0]:
+                energies = [parameters['energy'] for parameters in remaining]
+
+                for result in algorithm(**remaining[0]).fit_sample_path(X, y, energies, prepared=prepared):
+                    results.append(result)
+            else:
+                results.append(algorithm(**remaining[0]).fit_sample(X, y))
+        except (ValueError, RuntimeError) as e:
+            results.append(e)
+
+    return results
+
+
+def _evaluate(algorithm, classifier, metrics, group, X_train, y_train, X_test, y_test, prepared=None):
+    scores = []
+
+    for result in _resample(algorithm, group, X_train, y_train, prepared):
+        if isinstance(result, Exception) or len(np.unique(result[1])) < 2:
+            scores.append(-np.inf)
+        else:
+            predictions = clone(classifier).fit(*result).predict(X_test)
+
+            scores.append(np.mean([metric(y_test, predictions) for metric in metrics]))
+
+    return scores
+
+
+SEARCHES = ['grid', 'halving']
+
+
 class ResamplingCV:
-    def __init__(self, algorithm, classifier, metrics=(auc,), n=3, seed=None, **kwargs):
+    def __init__(self, algorithm, classifier, metrics=(auc,), n=3, seed=None, n_jobs=None,
+                 search='grid', n_rounds=None, elimination_rate=0.5, split_cache=SPLIT_CACHE, **kwargs):
+        if search not in SEARCHES:
+            raise ValueError(f'Unknown search "{search}", expected one of {SEARCHES}.')
+
+        if n_rounds is not None and n_rounds < 1:
+            raise ValueError(f'n_rounds must be at least 1, got {n_rounds}.')
+
+        if not 0.0 <= elimination_rate < 1.0:
+            raise ValueError(f'elimination_rate must be in [0, 1), got {elimination_rate}.')
+
         self.algorithm = algorithm
         self.classifier = classifier
         self.metrics = metrics
         self.n = n
         self.seed = seed
+        self.n_jobs = n_jobs
+        self.search = search
+        self.n_rounds = n_rounds
+        self.elimination_rate = elimination_rate
+        self.split_cache = split_cache
         self.kwargs = kwargs
 
     def fit_sample(self, X, y):
         best_score = -np.inf
         best_parameters = None
 
-        parameter_combinations = list((dict(zip(self.kwargs, x)) for x in product(*self.kwargs.values())))
+        # generators are resolved once, so that every combination, split and worker derives its streams from
+        # the same state
+        values = [[seed_sequence(value) if isinstance(value, np.random.Generator) else value for value in values]
+                  for values in self.kwargs.values()]
+        parameter_combinations = list((dict(zip(self.kwargs, x)) for x in product(*values)))
 
         if len(parameter_combinations) == 1:
             return self.algorithm(**parameter_combinations[0]).fit_sample(X, y)
 
-        for parameters in parameter_combinations:
-            scores = []
+        splits = []
 
-            for i in range(self.n):
-                skf = StratifiedKFold(n_splits=2, shuffle=True, random_state=self.seed + i)
+        for seed in _split_seeds(self.seed, self.n):
+            if self.split_cache is None:
+                splits.extend(_split(X, y, seed))
+            else:
+                splits.extend(self.split_cache.splits(X, y, seed))
 
-                for train_idx, test_idx in skf.split(X, y):
-                    try:
-                        X_train, y_train = self.algorithm(**parameters).fit_sample(X[train_idx], y[train_idx])
-                    except (ValueError, RuntimeError) as e:
-                        scores.append(-np.inf)
+        if self.search == 'halving':
+            n_rounds = len(splits) if self.n_rounds is None else min(self.n_rounds, len(splits))
+            rounds = np.array_split(np.arange(len(splits)), n_rounds)
+        else:
+            rounds = [np.arange(len(splits))]
 
-                        break
-                    else:
-                        if len(np.unique(y_train)) < 2:
-                            scores.append(-np.inf)
+        scores = [[] for _ in parameter_combinations]
+        candidates = list(range(len(parameter_combinations)))
 
-                            break
+        for r, round_splits in enumerate(rounds):
+            self._score(X, y, parameter_combinations, candidates, splits, round_splits, scores)
 
-                        classifier = self.classifier.fit(X_train, y_train)
-                        predictions = classifier.predict(X[test_idx])
+            # after every round but the last, the worst candidates by mean score so far are dropped,
+            # so only the survivors are evaluated with the full budget of splits
+            if r < len(rounds) - 1:
+                n_kept = max(1, int(np.ceil(len(candidates) * (1.0 - self.elimination_rate))))
+                ranking = sorted(candidates, key=lambda k: -np.mean(scores[k]))
+                candidates = sorted(ranking[:n_kept])
 
-                        scores.append(np.mean([metric(y[test_idx], predictions) for metric in self.metrics]))
-
-            score = np.mean(scores)
+        for k in candidates:
+            score = np.mean(scores[k])
 
             if score > best_score:
                 best_score = score
-                best_parameters = parameters
+                best_parameters = parameter_combinations[k]
 
         if best_parameters is None:
             best_parameters = parameter_combinations[0]
 
         return self.algorithm(**best_parameters).fit_sample(X, y)
+
+    def _score(self, X, y, parameter_combinations, candidates, splits, round_splits, scores):
+        # the first split of a round is evaluated on its own, so that combinations failing on it, whose mean score
+        # is already -inf, are not refitted on the remaining splits of the round or in later rounds
+        for wave in [round_splits[:1], round_splits[1:]]:
+            groups = [[k for k in group if -np.inf not in scores[k]] for group in self._parameter_groups(candidates)]
+            tasks = [(group, j) for j in wave for group in groups if len(group) > 0]
+            keys = [_preparation_key(self.algorithm, parameter_combinations[group[0]]) for group, _ in tasks]
+
+            self._prepare(parameter_combinations, splits, tasks, keys)
+
+            with tempfile.TemporaryDirectory() as folder:
+                shared = {}
+
+                if self.n_jobs is not None and self.n_jobs != 1:
+                    for (_, j), key in zip(tasks, keys):
+                        if key is not None and (j, key) not in shared:
+                            shared[(j, key)] = _share(splits[j]['structures'][key], folder)
+
+                results = Parallel(n_jobs=self.n_jobs)(
+                    delayed(_evaluate)(
+                        self.algorithm, self.classifier, self.metrics,
+                        [_split_parameters(parameter_combinations[k], j) for k in group],
+                        splits[j]['X_train'], splits[j]['y_train'], splits[j]['X_test'], splits[j]['y_test'],
+                        None if key is None else shared.get((j, key), splits[j]['structures'][key])
+                    ) for (group, j), key in zip(tasks, keys)
+                )
+
+            for (group, _), group_scores in zip(tasks, results):
+                for k, score in zip(group, group_scores):
+                    scores[k].append(score)
+
+    def _prepare(self, parameter_combinations, splits, tasks, keys):
+        missing = OrderedDict()
+
+        for (group, j), key in zip(tasks, keys):
+            if key is not None and key not in splits[j]['structures']:
+                missing.setdefault((j, key), parameter_combinations[group[0]])
+
+        # structures shared by every combination of a group, such as RBCCR distances, are computed once per
+        # split before the evaluations are dispatched, and kept with the split for later groups and resamplers
+        prepared = Parallel(n_jobs=self.n_jobs)(
+            delayed(_prepare)(self.algorithm, parameters, splits[j]['X_train'], splits[j]['y_train'])
+            for (j, _), parameters in missing.items()
+        )
+
+        for (j, key), structures in zip(missing, prepared):
+            for array in structures:
+                if isinstance(array, np.ndarray):
+                    array.flags.writeable = False
+
+            splits[j]['structures'][key] = structures
+
+        if self.split_cache is not None:
+            self.split_cache.shrink()
+
+    def _parameter_groups(self, candidates):
+        indices = list(product(*(range(len(values)) for values in self.kwargs.values())))
+
+        if not hasattr(self.algorithm, 'fit_sample_path') or 'energy' not in self.kwargs:
+            return [[k] for k in candidates]
+
+        # combinations differing only in energy are resampled together along a single energy path
+        energy_position = list(self.kwargs).index('energy')
+        groups = {}
+
+        for k in candidates:
+            index = indices[k]
+            groups.setdefault(index[:energy_position] + index[(energy_position + 1):], []).append(k)
+
+        return list(groups.values())
@@ -1,9 +1,15 @@
+import hashlib
 import os
+import shutil
+import tempfile
 import zipfile
 import numpy as np
 import pandas as pd
 import pickle
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pandas.api.types import is_numeric_dtype
 from sklearn import preprocessing
 from sklearn.model_selection import StratifiedKFold
 from sklearn.preprocessing import StandardScaler
@@ -11,27 +17,190 @@ from urllib.request import urlretrieve
 
 
 DATA_PATH = os.path.join(os.path.dirname(__file__), 'data')
+CACHE_PATH = os.path.join(DATA_PATH, 'cache')
+MANIFEST_PATH = os.path.join(DATA_PATH, 'manifest.txt')
 FOLDS_PATH = os.path.join(os.path.dirname(__file__), 'folds')
 
 RANDOM_SEED = 42
 
 
-def download(url):
+class DatasetCache:
+    def __init__(self, max_bytes=2 ** 30):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+
+        return read_only_views(self.entries[key][0])
+
+    def put(self, key, folds):
+        folds = read_only_views(folds)
+        n_bytes = sum(array.nbytes for fold in folds for subset in fold for array in subset)
+
+        if key in self.entries:
+            self.n_bytes -= self.entries.pop(key)[1]
+
+        self.entries[key] = (folds, n_bytes)
+        self.n_bytes += n_bytes
+
+        while self.n_bytes > self.max_bytes and len(self.entries) > 1:
+            self.n_bytes -= self.entries.popitem(last=False)[1][1]
+
+        return read_only_views(folds)
+
+    def clear(self):
+        self.entries.clear()
+        self.n_bytes = 0
+
+
+DATASET_CACHE = DatasetCache()
+
+
+def read_only_views(folds):
+    result = []
+
+    for fold in folds:
+        result.append([])
+
+        for subset in fold:
+            views = []
+
+            for array in subset:
+                view = array.view()
+                view.flags.writeable = False
+                views.append(view)
+
+            result[-1].append(views)
+
+    return result
+
+
+def download(url, checksum=None):
     name = url.split('/')[-1]
     download_path = os.path.join(DATA_PATH, name)
 
+    if not name.endswith('.zip'):
+        raise Exception('Unrecognized file type.')
+
+    if os.path.exists(download_path.replace('.zip', '.dat')):
+        return None
+
     if not os.path.exists(DATA_PATH):
-        os.makedirs(DATA_PATH)
+        os.makedirs(DATA_PATH, exist_ok=True)
+
+    # archives are written under a temporary name and only renamed into place once complete and verified,
+    # so an interrupted run leaves nothing that a later one mistakes for a finished download
+    if os.path.exists(download_path) and not verify(download_path, checksum):
+        os.remove(download_path)
 
     if not os.path.exists(download_path):
-        urlretrieve(url, download_path)
+        handle, temporary_path = tempfile.mkstemp(dir=DATA_PATH, prefix=name, suffix='.part')
+        os.close(handle)
 
-    if not os.path.exists(download_path.replace('.zip', '.dat')):
-        if name.endswith('.zip'):
-            with zipfile.ZipFile(download_path) as f:
-                f.extractall(DATA_PATH)
-        else:
-            raise Exception('Unrecognized file type.')
+        try:
+            urlretrieve(url, temporary_path)
+
+            if not verify(temporary_path, checksum):
+                raise Exception('Checksum mismatch for %s.' % name)
+
+            os.replace(temporary_path, download_path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    extract(download_path)
+
+    return file_hash(download_path, 'sha256')
+
+
+def verify(path, checksum=None):
+    if checksum is not None:
+        return file_hash(path, 'sha256') == checksum
+
+    try:
+        with zipfile.ZipFile(path) as f:
+            return f.testzip() is None
+    except zipfile.BadZipFile:
+        return False
+
+
+def extract(path):
+    temporary_path = tempfile.mkdtemp(dir=DATA_PATH)
+
+    try:
+        with zipfile.ZipFile(path) as f:
+            f.extractall(temporary_path)
+
+        for root, _, file_names in os.walk(temporary_path):
+            for file_name in file_names:
+                target = os.path.join(DATA_PATH, os.path.relpath(os.path.join(root, file_name), temporary_path))
+
+                if not os.path.exists(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+                os.replace(os.path.join(root, file_name), target)
+    finally:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+
+
+def read_manifest():
+    manifest = {}
+
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH) as f:
+            for line in f:
+                if line.strip():
+                    checksum, name = line.split()
+                    manifest[name] = checksum
+
+    return manifest
+
+
+def write_manifest(manifest):
+    handle, temporary_path = tempfile.mkstemp(dir=DATA_PATH, suffix='.part')
+
+    with os.fdopen(handle, 'w') as f:
+        for name in sorted(manifest):
+            f.write('%s  %s\n' % (manifest[name], name))
+
+    os.replace(temporary_path, MANIFEST_PATH)
+
+
+def download_all(urls, n_workers=8):
+    manifest = read_manifest()
+    file_names = [url.split('/')[-1] for url in urls]
+
+    # checksums of archives not yet in the manifest are recorded on their first download and verified on
+    # every later one
+    with ThreadPoolExecutor(n_workers) as executor:
+        futures = [executor.submit(download, url, manifest.get(name)) for url, name in zip(urls, file_names)]
+
+    errors = []
+
+    # a failed download does not discard the checksums of the archives that did arrive
+    for url, name, future in zip(urls, file_names, futures):
+        if future.exception() is not None:
+            errors.append('%s: %s' % (url, future.exception()))
+        elif future.result() is not None:
+            manifest[name] = future.result()
+
+    if not os.path.exists(DATA_PATH):
+        os.makedirs(DATA_PATH, exist_ok=True)
+
+    write_manifest(manifest)
+
+    if len(errors) > 0:
+        raise Exception('Failed to download %d of %d archives:\n%s' % (len(errors), len(urls), '\n'.join(errors)))
 
 
 def encode(X, y, encode_features=True):
@@ -52,6 +221,94 @@ def encode(X, y, encode_features=True):
     return X.astype(np.float32), y.astype(np.float32)
 
 
+def read_header(path):
+    attributes = []
+    n_lines = 0
+
+    with open(path) as f:
+        for line in f:
+            if not line.startswith('@'):
+                break
+
+            n_lines += 1
+
+            if line.lower().startswith('@attribute'):
+                declaration = line.split(None, 1)[1].strip()
+
+                if declaration.startswith("'"):
+                    name, kind = declaration[1:].split("'", 1)
+                else:
+                    name, kind = (declaration.split(None, 1) + [''])[:2]
+
+                kind = kind.strip()
+
+                if kind.startswith('{'):
+                    attributes.append((name, [v.strip() for v in kind.strip('{}').split(',')]))
+                else:
+                    attributes.append((name, None))
+
+    return attributes, n_lines
+
+
+def read_keel(path):
+    attributes, skiprows = read_header(path)
+
+    # declared types spare the parser from inferring them; files whose data contradict the header
+    # fall back to inference
+    dtype = {k: (object if values is not None else np.float64) for k, (_, values) in enumerate(attributes)}
+
+    try:
+        df = pd.read_csv(path, header=None, skiprows=skiprows, skipinitialspace=True, na_values='?',
+                         engine='c', dtype=dtype)
+    except (ValueError, TypeError):
+        df = pd.read_csv(path, header=None, skiprows=skiprows, skipinitialspace=True, na_values='?', engine='c')
+
+    columns = []
+    missing = np.zeros(len(df), dtype=bool)
+
+    for column in df.columns:
+        series = df[column]
+
+        if is_numeric_dtype(series):
+            values = series.values.astype(np.float64)
+            missing |= np.isnan(values)
+            columns.append(values)
+
+            continue
+
+        # text is stripped, checked for missing markers and converted once per distinct value rather than
+        # once per row; values that can be parsed as numbers are kept as numbers, like the pandas parser does
+        codes, uniques = pd.factorize(series.astype(object))
+        uniques = np.array([str(u).strip() for u in uniques] + ['?'], dtype=object)
+        missing |= uniques[codes] == '?'
+
+        try:
+            values = np.array([np.nan if u == '?' else float(u) for u in uniques])[codes]
+            missing |= np.isnan(values)
+            columns.append(values)
+        except ValueError:
+            columns.append((codes, uniques))
+
+    X = np.zeros((np.sum(~missing), len(columns) - 1), dtype=np.float32)
+
+    for k, column in enumerate(columns):
+        if isinstance(column, tuple):
+            codes, uniques = column[0][~missing], column[1]
+            used = np.unique(codes)
+            lookup = np.zeros(len(uniques), dtype=int)
+            lookup[used] = np.unique(uniques[used].astype(str), return_inverse=True)[1]
+            values = lookup[codes]
+        else:
+            values = column[~missing]
+
+        if k < len(columns) - 1:
+            X[:, k] = values
+        else:
+            y = np.unique(values, return_inverse=True)[1].astype(np.float32)
+
+    return X, y
+
+
 def partition(X, y):
     partitions = []
 
@@ -67,29 +324,107 @@ def partition(X, y):
     return partitions
 
 
-def load(name, url=None, encode_features=True, remove_metadata=True, scale=True):
+def file_hash(path, algorithm='sha1'):
+    digest = hashlib.new(algorithm)
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def cache_key(name, encode_features=True, remove_metadata=True, scale=True):
+    data_path = os.path.join(DATA_PATH, '%s.dat' % name)
+    partitions_path = os.path.join(FOLDS_PATH, '%s.folds.pickle' % name)
+
+    digest = hashlib.sha1()
+    digest.update(file_hash(data_path).encode())
+
+    if os.path.exists(partitions_path):
+        digest.update(file_hash(partitions_path).encode())
+
+    digest.update(str((encode_features, remove_metadata, scale)).encode())
+
+    return '%s-%s' % (name, digest.hexdigest()[:16])
+
+
+def load_cached(key):
+    path = os.path.join(CACHE_PATH, key)
+
+    if not os.path.exists(path):
+        return None
+
+    folds_X = np.load(os.path.join(path, 'folds_X.npy'), mmap_mode='r')
+    folds_y = np.load(os.path.join(path, 'folds_y.npy'), mmap_mode='r')
+    train_sizes = np.load(os.path.join(path, 'train_sizes.npy'))
+
+    folds = []
+
+    for X, y, n in zip(folds_X, folds_y, train_sizes):
+        folds.append([[X[:n], y[:n]], [X[n:], y[n:]]])
+
+    return folds
+
+
+def save_cached(key, folds):
+    if not os.path.exists(CACHE_PATH):
+        os.makedirs(CACHE_PATH, exist_ok=True)
+
+    # every fold holds each sample exactly once, so the folds are stored as one (fold, sample, feature)
+    # array with the training part of each fold first; views into it are served without copying
+    folds_X = np.stack([np.concatenate([train_set[0], test_set[0]]) for train_set, test_set in folds])
+    folds_y = np.stack([np.concatenate([train_set[1], test_set[1]]) for train_set, test_set in folds])
+    train_sizes = np.array([len(train_set[1]) for train_set, _ in folds])
+
+    temporary_path = tempfile.mkdtemp(dir=CACHE_PATH)
+
+    for file_name, array in [('folds_X.npy', folds_X), ('folds_y.npy', folds_y), ('train_sizes.npy', train_sizes)]:
+        np.save(os.path.join(temporary_path, file_name), array)
+
+    try:
+        os.rename(temporary_path, os.path.join(CACHE_PATH, key))
+    except OSError:
+        shutil.rmtree(temporary_path, ignore_errors=True)
+
+
+def load(name, url=None, encode_features=True, remove_metadata=True, scale=True, cache=True):
     file_name = '%s.dat' % name
 
     if url is not None:
         download(url)
 
-    skiprows = 0
+    if cache:
+        folds = DATASET_CACHE.get((name, encode_features, remove_metadata, scale))
 
-    if remove_metadata:
-        with open(os.path.join(DATA_PATH, file_name)) as f:
-            for line in f:
-                if line.startswith('@'):
-                    skiprows += 1
-                else:
-                    break
+        if folds is not None:
+            return folds
 
-    df = pd.read_csv(os.path.join(DATA_PATH, file_name), header=None, skiprows=skiprows, skipinitialspace=True,
-                     sep=' *, *', na_values='?', engine='python')
+        folds = load_cached(cache_key(name, encode_features, remove_metadata, scale))
 
-    matrix = df.dropna().values
+        if folds is not None:
+            return DATASET_CACHE.put((name, encode_features, remove_metadata, scale), folds)
 
-    X, y = matrix[:, :-1], matrix[:, -1]
-    X, y = encode(X, y, encode_features)
+    if remove_metadata and encode_features:
+        X, y = read_keel(os.path.join(DATA_PATH, file_name))
+    else:
+        skiprows = 0
+
+        if remove_metadata:
+            with open(os.path.join(DATA_PATH, file_name)) as f:
+                for line in f:
+                    if line.startswith('@'):
+                        skiprows += 1
+                    else:
+                        break
+
+        df = pd.read_csv(os.path.join(DATA_PATH, file_name), header=None, skiprows=skiprows,
+                         skipinitialspace=True, sep=' *, *', na_values='?', engine='python')
+
+        matrix = df.dropna().values
+
+        X, y = matrix[:, :-1], matrix[:, -1]
+        X, y = encode(X, y, encode_features)
 
     partitions_path = os.path.join(FOLDS_PATH, file_name.replace('.dat', '.folds.pickle'))
 
@@ -119,6 +454,11 @@ def load(name, url=None, encode_features=True, remove_metadata=True, scale=True)
 
             folds.append([train_set, test_set])
 
+    if cache:
+        save_cached(cache_key(name, encode_features, remove_metadata, scale), folds)
+
+        return DATASET_CACHE.put((name, encode_features, remove_metadata, scale), folds)
+
     return folds
 
 
@@ -136,7 +476,9 @@ def names():
     return [url.split('/')[-1].replace('.zip', '') for url in urls()]
 
 
-def load_all():
+def load_all(n_workers=8):
+    download_all(urls(), n_workers)
+
     datasets = {}
 
     for url, name in zip(urls(), names()):
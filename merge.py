@@ -1,23 +1,28 @@
-import pandas as pd
+import logging
 
 from pathlib import Path
-from tqdm import tqdm
+from results_store import ResultsStore
 
 
 RESULTS_PATH = Path(__file__).parent / 'results'
 
 
 if __name__ == '__main__':
+    # the experiments are imported only when merging, as the analysis scripts import RESULTS_PATH from here
+    import scheduler
+
+    logging.basicConfig(level=logging.INFO)
+
     RESULTS_PATH.mkdir(exist_ok=True, parents=True)
 
-    for trial in ['preliminary_energy', 'final']:
-        input_directory = Path(f'results_{trial}')
+    store = ResultsStore()
 
-        dfs = []
+    for trial in ['preliminary_energy', 'final']:
+        scheduler.import_legacy(trial)
+        scheduler.merge_worker_stores(trial)
 
-        for path in tqdm(input_directory.iterdir(), desc=f'Trial: {trial}'):
-            df = pd.read_csv(path)
-            dfs.append(df)
+        for kind in ['results', 'telemetry']:
+            df = store.read(trial, kind)
 
-        df = pd.concat(dfs)
-        df.to_csv(RESULTS_PATH / f'results_{trial}.csv', index=False)
+            if df is not None:
+                df.to_csv(RESULTS_PATH / f'{kind}_{trial}.csv', index=False)
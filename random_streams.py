@@ -0,0 +1,24 @@
+import numpy as np
+
+
+def seed_sequence(random_state=None):
+    if isinstance(random_state, np.random.SeedSequence):
+        return random_state
+    elif isinstance(random_state, np.random.Generator):
+        # a generator is advanced once, so that every fit drawing from it starts a fresh family of streams
+        return np.random.SeedSequence(int(random_state.integers(2 ** 63)))
+    else:
+        return np.random.SeedSequence(random_state)
+
+
+def child(random_state, k):
+    parent = seed_sequence(random_state)
+
+    # unlike SeedSequence.spawn(), the k-th child does not depend on how many children were spawned before,
+    # so the same parent always yields the same streams, whatever order they are requested in
+    return np.random.SeedSequence(parent.entropy, spawn_key=parent.spawn_key + (int(k),), pool_size=parent.pool_size)
+
+
+def generator(random_state, k):
+    return np.random.default_rng(child(random_state, k))
+
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+from functools import lru_cache
+from scipy.special import comb
+from scipy.stats import chi2, norm, rankdata
+
+
+def rank_matrix(scores):
+    # the highest score of every row is ranked first, tied scores share the average of their ranks
+    return rankdata(-np.asarray(scores, dtype=float), axis=-1)
+
+
+def friedman_test(scores):
+    scores = np.asarray(scores, dtype=float)
+    n, k = scores.shape[-2:]
+
+    mean_ranks = np.mean(rank_matrix(scores), axis=-2)
+    statistic = 12 * n / (k * (k + 1)) * (np.sum(mean_ranks ** 2, axis=-1) - k * (k + 1) ** 2 / 4)
+
+    return mean_ranks, statistic, 1 - chi2.cdf(statistic, k - 1)
+
+
+@lru_cache(maxsize=None)
+def shaffer_sets(k):
+    if k <= 1:
+        return frozenset([0])
+
+    # possible numbers of true hypotheses among all pairwise comparisons of k methods
+    result = set()
+
+    for j in range(1, k + 1):
+        result |= {int(comb(j, 2)) + s for s in shaffer_sets(k - j)}
+
+    return frozenset(result)
+
+
+def shaffer_multipliers(k):
+    m = k * (k - 1) // 2
+    sets = np.array(sorted(shaffer_sets(k)))
+
+    return np.array([sets[sets <= m - i].max() for i in range(m)])
+
+
+def friedman_post_hoc(scores):
+    scores = np.asarray(scores, dtype=float)
+    n, k = scores.shape[-2:]
+
+    mean_ranks = np.mean(rank_matrix(scores), axis=-2)
+    z = np.abs(mean_ranks[..., :, None] - mean_ranks[..., None, :]) / np.sqrt(k * (k + 1) / (6 * n))
+    p_values = 2 * (1 - norm.cdf(z))
+
+    # Shaffer's static procedure: the i-th smallest p-value is multiplied by the largest number of hypotheses
+    # that can still be true once the i - 1 before it are rejected, and the products are made monotone
+    rows, columns = np.triu_indices(k, 1)
+    pairwise = p_values[..., rows, columns]
+    order = np.argsort(pairwise, axis=-1, kind='stable')
+    adjusted = np.take_along_axis(pairwise, order, axis=-1) * shaffer_multipliers(k)
+    adjusted = np.minimum(np.maximum.accumulate(adjusted, axis=-1), 1.0)
+
+    corrected = np.empty_like(pairwise)
+    np.put_along_axis(corrected, order, adjusted, axis=-1)
+
+    corrected_p_values = np.full(p_values.shape, np.nan)
+    corrected_p_values[..., rows, columns] = corrected
+    corrected_p_values[..., columns, rows] = corrected
+
+    return mean_ranks, p_values, corrected_p_values
+
+
+def test_friedman_shaffer_many(dictionaries):
+    dictionaries = list(dictionaries)
+    columns = [list(pd.DataFrame(dictionary).columns) for dictionary in dictionaries]
+    scores = np.stack([pd.DataFrame(dictionary).values for dictionary in dictionaries])
+
+    _, _, p_values = friedman_test(scores)
+    mean_ranks, _, corrected_p_values = friedman_post_hoc(scores)
+
+    results = []
+
+    for names, ranks, p_value, corrected in zip(columns, mean_ranks, p_values, corrected_p_values):
+        ranks_dict = {name: rank for name, rank in zip(names, ranks)}
+        corrected_p_values_dict = {outer: {inner: p for inner, p in zip(names, row)}
+                                   for outer, row in zip(names, corrected)}
+
+        results.append((ranks_dict, p_value, corrected_p_values_dict))
+
+    return results
+
+
+def test_friedman_shaffer(dictionary):
+    return test_friedman_shaffer_many([dictionary])[0]
+
+
+def test_friedman_shaffer_scmamp(dictionary):
+    from rpy2.robjects import pandas2ri, r
+    from rpy2.robjects.packages import importr
+
+    df = pd.DataFrame(dictionary)
+
+    columns = df.columns
+
+    pandas2ri.activate()
+
+    importr('scmamp')
+
+    initial_results = r['friedmanTest'](df)
+    posthoc_results = r['postHocTest'](df, test='friedman', correct='shaffer', use_rank=True)
+
+    ranks = np.array(posthoc_results[0])[0]
+    p_value = initial_results[2][0]
+    corrected_p_values = np.array(posthoc_results[2])
+
+    ranks_dict = {col: rank for col, rank in zip(columns, ranks)}
+    corrected_p_values_dict = {outer: {inner: p for inner, p in zip(columns, row)}
+                               for outer, row in zip(columns, corrected_p_values)}
+
+    return ranks_dict, p_value, corrected_p_values_dict
@@ -1,5 +1,10 @@
 import numpy as np
 
+from random_streams import child, generator, seed_sequence
+from sklearn.neighbors import NearestNeighbors
+
+MEMORY_LIMIT = 2 ** 27
+
 
 def distance(x, y, p_norm=2):
     return np.sum(np.abs(x - y) ** p_norm) ** (1 / p_norm)
@@ -24,7 +29,111 @@ def mutual_class_potential(point, majority_points, minority_points, gamma):
     return result
 
 
-def generate_possible_directions(n_dimensions, excluded_direction=None):
+def distances(points, others):
+    return np.sum(np.abs(points[np.newaxis] - others[:, np.newaxis]) ** 2, axis=-1) ** (1 / 2)
+
+
+def nearest_neighbors(points, X, n_neighbors):
+    n_neighbors = min(n_neighbors, len(X))
+    own_indices = np.arange(len(points))[:, np.newaxis]
+
+    if n_neighbors <= 1:
+        return own_indices[:, :n_neighbors]
+
+    # as in the original per-point search, the point of X at the query's own index is always taken first, followed
+    # by the nearest of the remaining points, so one of the n_neighbors candidates returned by the index is dropped
+    candidates = NearestNeighbors(n_neighbors=n_neighbors).fit(X).kneighbors(points, return_distance=False)
+    others = candidates != own_indices
+    others &= np.cumsum(others, axis=1) < n_neighbors
+    candidates = candidates[others].reshape(len(points), n_neighbors - 1)
+
+    # the candidates are ordered by their exact distances, the same ones the potential is computed from, with ties
+    # broken by index
+    candidate_distances = np.sum(np.abs(X[candidates] - points[:, np.newaxis]) ** 2, axis=-1) ** (1 / 2)
+    order = np.lexsort((candidates, candidate_distances), axis=-1)
+
+    return np.concatenate([own_indices, np.take_along_axis(candidates, order, axis=1)], axis=1)
+
+
+def mutual_class_potentials(points, majority_points, minority_points, gamma):
+    result = np.zeros(len(points))
+
+    if gamma == 0.0:
+        return result
+
+    # the contributions are accumulated one neighbour at a time, in the order of mutual_class_potential()
+    for row in np.exp(-(distances(points, majority_points) / gamma) ** 2):
+        result += row
+
+    for row in np.exp(-(distances(points, minority_points) / gamma) ** 2):
+        result -= row
+
+    return result
+
+
+def lockstep_potentials(positions, neighbors, weights, gamma):
+    result = np.zeros(positions.shape[:2])
+
+    if gamma == 0.0:
+        return result
+
+    # positions is (points, candidates, dimensions), neighbors is (points, neighbours, dimensions) with the
+    # majority points first, and weights is +1 for majority and -1 for minority neighbours; accumulating one
+    # neighbour at a time gives every point the same sums as mutual_class_potentials()
+    d = np.sum(np.abs(positions[:, :, np.newaxis] - neighbors[:, np.newaxis]) ** 2, axis=-1) ** (1 / 2)
+    contributions = np.exp(-(d / gamma) ** 2)
+
+    for k in range(neighbors.shape[1]):
+        result += weights[:, k, np.newaxis] * contributions[:, :, k]
+
+    return result
+
+
+class IncrementalPotentials:
+    def __init__(self, points, neighbors, weights, gamma):
+        self.gamma = gamma
+        self.weights = weights
+
+        # per-neighbour coordinate differences and their squares are cached for every point, so that a step along
+        # a single axis updates the squared distances in O(k) instead of recomputing them in O(k * d)
+        self.differences = points[:, np.newaxis] - neighbors
+        self.squares = self.differences ** 2
+        self.squared_distances = np.sum(self.squares, axis=2)
+
+    def potentials(self, weights, squared_distances):
+        if self.gamma == 0.0:
+            return np.zeros((len(squared_distances), squared_distances.shape[2]))
+
+        return np.matmul(weights[:, np.newaxis], np.exp(-squared_distances / self.gamma ** 2))[:, 0]
+
+    def potential(self):
+        return self.potentials(self.weights, self.squared_distances[:, :, np.newaxis])[:, 0]
+
+    def evaluate(self, active, dimensions, shifts):
+        shape = (len(active), self.differences.shape[1], dimensions.shape[1])
+        indices = np.broadcast_to(dimensions[:, np.newaxis], shape)
+
+        moved = np.take_along_axis(self.differences[active], indices, axis=2) + shifts[:, np.newaxis]
+        squared_distances = self.squared_distances[active][:, :, np.newaxis] - \
+            np.take_along_axis(self.squares[active], indices, axis=2) + moved ** 2
+
+        self.candidates = (active, dimensions, moved, squared_distances)
+
+        return self.potentials(self.weights[active], squared_distances)
+
+    def accept(self, found, k):
+        active, dimensions, moved, squared_distances = self.candidates
+        rows = np.flatnonzero(found)
+        points, columns = active[rows], k[rows]
+
+        self.differences[points, :, dimensions[rows, columns]] = moved[rows, :, columns]
+        self.squares[points, :, dimensions[rows, columns]] = moved[rows, :, columns] ** 2
+        self.squared_distances[points] = squared_distances[rows, :, columns]
+
+
+def generate_possible_directions(n_dimensions, excluded_direction=None, rng=None):
+    rng = np.random.default_rng() if rng is None else rng
+
     possible_directions = []
 
     for dimension in range(n_dimensions):
@@ -32,14 +141,15 @@ def generate_possible_directions(n_dimensions, excluded_direction=None):
             if excluded_direction is None or (excluded_direction[0] != dimension or excluded_direction[1] != sign):
                 possible_directions.append((dimension, sign))
 
-    np.random.shuffle(possible_directions)
+    rng.shuffle(possible_directions)
 
     return possible_directions
 
 
 class RBO:
     def __init__(self, gamma=0.05, step_size=0.001, n_steps=500, approximate_potential=True,
-                 n_nearest_neighbors=25, minority_class=None, n=None, random_state=None):
+                 n_nearest_neighbors=25, minority_class=None, n=None, random_state=None,
+                 incremental_potential=False, memory_limit=MEMORY_LIMIT):
         self.gamma = gamma
         self.step_size = step_size
         self.n_steps = n_steps
@@ -48,9 +158,11 @@ class RBO:
         self.minority_class = minority_class
         self.n = n
         self.random_state = random_state
+        self.incremental_potential = incremental_potential
+        self.memory_limit = memory_limit
 
     def fit_sample(self, X, y):
-        np.random.seed(self.random_state)
+        random_state = seed_sequence(self.random_state)
 
         classes = np.unique(y)
 
@@ -69,60 +181,128 @@ class RBO:
         else:
             n = self.n
 
-        appended = []
-        sorted_neighbors_indices = None
-        considered_minority_points_indices = range(len(minority_points))
+        n_synthetic_points_per_minority_object = np.bincount(
+            generator(random_state, 0).choice(len(minority_points), n), minlength=len(minority_points)
+        )
+
+        # the j-th synthetic point of the i-th seed searches its directions with its own stream, so it does not
+        # depend on the order in which the synthetic points are advanced
+        direction_state = child(random_state, 1)
+
+        counts = n_synthetic_points_per_minority_object
+        seeds = np.repeat(np.arange(len(minority_points)), counts)
+        occurrences = np.arange(len(seeds)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        # the neighbours of every seed are stored majority first, with a weight of +1 for majority and -1 for
+        # minority neighbours, so that the potentials of many points are computed with the same array operations
+        if self.approximate_potential:
+            indices = nearest_neighbors(minority_points, X, self.n_nearest_neighbors + 1)
+            indices = np.take_along_axis(
+                indices, np.argsort(y[indices] == minority_class, axis=1, kind='stable'), axis=1
+            )
+
+            neighbors = X[indices]
+            weights = np.where(y[indices] == minority_class, -1.0, 1.0)
+        else:
+            neighbors = np.concatenate([majority_points, minority_points])[np.newaxis]
+            weights = np.concatenate([np.ones(len(majority_points)), -np.ones(len(minority_points))])[np.newaxis]
+
+        n_dimensions = X.shape[1]
+        n_neighbors = neighbors.shape[1]
+
+        # the (points, directions, neighbours, dimensions) difference tensor is the largest temporary
+        chunk_size = max(1, self.memory_limit // max(n_neighbors * 2 * n_dimensions * n_dimensions * 8, 1))
+
+        appended = [np.zeros((0, n_dimensions))]
 
-        n_synthetic_points_per_minority_object = {i: 0 for i in considered_minority_points_indices}
+        for start in range(0, len(seeds), chunk_size):
+            chunk = seeds[start:(start + chunk_size)]
+            rngs = [generator(child(direction_state, i), j)
+                    for i, j in zip(chunk, occurrences[start:(start + chunk_size)])]
 
-        for _ in range(n):
-            idx = np.random.choice(considered_minority_points_indices)
-            n_synthetic_points_per_minority_object[idx] += 1
+            appended.append(minority_points[chunk] + self._translations(
+                minority_points[chunk], neighbors[chunk] if self.approximate_potential else neighbors,
+                weights[chunk] if self.approximate_potential else weights, rngs
+            ))
 
-        for i in considered_minority_points_indices:
-            if n_synthetic_points_per_minority_object[i] == 0:
-                continue
+        appended = np.concatenate(appended)
 
-            point = minority_points[i]
+        return np.concatenate([X, appended]), np.concatenate([y, minority_class * np.ones(len(appended))])
+
+    def _translations(self, points, neighbors, weights, rngs):
+        n_points, n_dimensions = points.shape
+
+        neighbors = np.broadcast_to(neighbors, (n_points,) + neighbors.shape[1:])
+        weights = np.broadcast_to(weights, (n_points,) + weights.shape[1:])
+
+        translations = np.zeros(points.shape)
+        n_remaining_steps = np.full(n_points, self.n_steps)
+
+        if self.incremental_potential:
+            incremental = IncrementalPotentials(points, neighbors, weights, self.gamma)
+            potentials = incremental.potential()
+        else:
+            potentials = lockstep_potentials(points[:, np.newaxis], neighbors, weights, self.gamma)[:, 0]
+
+        # the directions left to try from the current translation of every point, in the order they are popped
+        queue_dimensions = np.zeros((n_points, 2 * n_dimensions), dtype=int)
+        queue_signs = np.zeros((n_points, 2 * n_dimensions), dtype=int)
+        queue_sizes = np.zeros(n_points, dtype=int)
+
+        def enqueue(p, excluded_direction=None):
+            directions = generate_possible_directions(n_dimensions, excluded_direction, rngs[p])[::-1]
 
-            if self.approximate_potential:
-                if sorted_neighbors_indices is None:
-                    distance_vector = [distance(point, x) for x in X]
-                    distance_vector[i] = -np.inf
-                    indices = np.argsort(distance_vector)[:(self.n_nearest_neighbors + 1)]
-                else:
-                    indices = sorted_neighbors_indices[i][:(self.n_nearest_neighbors + 1)]
+            queue_sizes[p] = len(directions)
 
-                closest_points = X[indices]
-                closest_labels = y[indices]
-                closest_minority_points = closest_points[closest_labels == minority_class]
-                closest_majority_points = closest_points[closest_labels != minority_class]
+            if len(directions) > 0:
+                queue_dimensions[p, :len(directions)], queue_signs[p, :len(directions)] = np.array(directions).T
+
+        for p in range(n_points):
+            enqueue(p)
+
+        active = np.flatnonzero((n_remaining_steps > 0) & (queue_sizes > 0))
+
+        # all points are advanced in lockstep: every round evaluates, for each point still moving, every direction
+        # it would still try from its current translation, and accepts the first improving one in the order they
+        # would be popped, at the cost of one step for every direction tried up to and including it, as in a
+        # one-at-a-time search
+        while len(active) > 0:
+            n_candidates = np.minimum(queue_sizes[active], n_remaining_steps[active])
+            width = n_candidates.max()
+            valid = np.arange(width) < n_candidates[:, np.newaxis]
+
+            dimensions = queue_dimensions[active, :width]
+            signs = queue_signs[active, :width]
+
+            modified_translations = np.repeat(translations[active][:, np.newaxis], width, axis=1)
+            rows, columns = np.nonzero(valid)
+            modified_translations[rows, columns, dimensions[rows, columns]] += signs[rows, columns] * self.step_size
+
+            if self.incremental_potential:
+                modified_potentials = incremental.evaluate(active, dimensions, signs * self.step_size)
             else:
-                closest_minority_points = minority_points
-                closest_majority_points = majority_points
+                modified_potentials = lockstep_potentials(
+                    points[active][:, np.newaxis] + modified_translations, neighbors[active], weights[active],
+                    self.gamma
+                )
 
-            for _ in range(n_synthetic_points_per_minority_object[i]):
-                translation = [0 for _ in range(len(point))]
-                translation_history = [translation]
-                potential = mutual_class_potential(point, closest_majority_points, closest_minority_points, self.gamma)
-                possible_directions = generate_possible_directions(len(point))
+            improvements = valid & (np.abs(modified_potentials) < np.abs(potentials[active])[:, np.newaxis])
+            found = improvements.any(axis=1)
+            k = np.argmax(improvements, axis=1)
 
-                for _ in range(self.n_steps):
-                    if len(possible_directions) == 0:
-                        break
+            if self.incremental_potential:
+                incremental.accept(found, k)
 
-                    dimension, sign = possible_directions.pop()
-                    modified_translation = translation.copy()
-                    modified_translation[dimension] += sign * self.step_size
-                    modified_potential = mutual_class_potential(point + modified_translation, closest_majority_points,
-                                                                closest_minority_points, self.gamma)
+            rows = np.flatnonzero(found)
+            moved = active[rows]
 
-                    if np.abs(modified_potential) < np.abs(potential):
-                        translation = modified_translation
-                        translation_history.append(translation)
-                        potential = modified_potential
-                        possible_directions = generate_possible_directions(len(point), (dimension, -sign))
+            n_remaining_steps[moved] -= k[rows] + 1
+            translations[moved] = modified_translations[rows, k[rows]]
+            potentials[moved] = modified_potentials[rows, k[rows]]
 
-                appended.append(point + translation)
+            for p, dimension, sign in zip(moved, dimensions[rows, k[rows]], signs[rows, k[rows]]):
+                enqueue(p, (dimension, -sign))
 
-        return np.concatenate([X, appended]), np.concatenate([y, minority_class * np.ones(len(appended))])
+            active = moved[(n_remaining_steps[moved] > 0) & (queue_sizes[moved] > 0)]
+
+        return translations
@@ -0,0 +1,163 @@
+import matplotlib
+
+matplotlib.use('Agg')
+
+import argparse
+import logging
+
+from algorithm import RBCCR
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from imblearn.over_sampling import BorderlineSMOTE, SMOTE
+from rbo import RBO
+from visualization_tools import prepare_data, visualize
+
+
+def energy_sphere_radius(X, y, energy):
+    rbccr = RBCCR(
+        energy=energy, p_norm=2, regions='LEH',
+        gamma=None, random_state=42,
+        keep_appended=True, keep_radii=True
+    )
+    X_, y_ = rbccr.fit_sample(X, y)
+
+    return dict(X=X_[:X.shape[0]], y=y_[:y.shape[0]], appended=rbccr.appended, radii=rbccr.radii, lim=(-0.05, 1.05))
+
+
+def method_comparison(X, y, method_name, energy, gamma):
+    methods = {
+        'none': lambda: None,
+        'smote': lambda: SMOTE(random_state=42),
+        'bord': lambda: BorderlineSMOTE(random_state=42),
+        'rbo': lambda: RBO(gamma=gamma, n_steps=100, random_state=42),
+        'ccr': lambda: RBCCR(energy=energy, gamma=gamma, regions='LEH', random_state=42),
+        'rb-ccr': lambda: RBCCR(energy=energy, gamma=gamma, regions='E', random_state=42)
+    }
+
+    method = methods[method_name]()
+
+    if method is None:
+        return dict(X=X, y=y, appended=None, lim=(-0.05, 1.05))
+
+    X_, y_ = method.fit_sample(X, y)
+
+    return dict(X=X_[:X.shape[0]], y=y_[:y.shape[0]], appended=X_[X.shape[0]:], lim=(-0.05, 1.05))
+
+
+def potential(X, y, gamma):
+    return dict(X=X, y=y, gamma=gamma)
+
+
+def regions_placement(X, y, energy, gamma, regions):
+    rbccr = RBCCR(
+        energy=energy, p_norm=2, regions=regions,
+        gamma=gamma, random_state=42,
+        keep_appended=True, keep_radii=True
+    )
+    rbccr.fit_sample(X, y)
+
+    return dict(X=X, y=y, gamma=gamma, appended=rbccr.appended, radii=rbccr.radii)
+
+
+def regions_sphere(X, y, energy, gamma):
+    rbccr = RBCCR(
+        energy=energy, p_norm=2, regions='LEH',
+        gamma=gamma, random_state=42,
+        keep_appended=True, keep_radii=True
+    )
+    rbccr.fit_sample(X, y)
+
+    minority_class = Counter(y).most_common()[1][0]
+    minority_points = X[y == minority_class]
+
+    return dict(X=X, y=y, gamma=gamma, regions_center=minority_points[1], regions_radius=rbccr.radii[1])
+
+
+FIGURES = {
+    'energy_sphere_radius': energy_sphere_radius,
+    'method_comparison': method_comparison,
+    'potential': potential,
+    'regions_placement': regions_placement,
+    'regions_sphere': regions_sphere
+}
+
+
+def figures(name=None):
+    specifications = []
+
+    for energy in [0.1, 0.25, 0.5, 1.0]:
+        specifications.append(dict(
+            figure='energy_sphere_radius', dataset_name='pima', n_minority_samples=15, scaler='MinMax',
+            parameters=dict(energy=energy), file_name=f'energy_sphere_radius_{energy}'
+        ))
+
+    for method_name in ['none', 'smote', 'bord', 'rbo', 'ccr', 'rb-ccr']:
+        specifications.append(dict(
+            figure='method_comparison', dataset_name='vehicle3', n_minority_samples=25, scaler='MinMax',
+            parameters=dict(method_name=method_name, energy=0.25, gamma=0.1),
+            file_name=f'method_comparison_{method_name}'
+        ))
+
+    for gamma in [0.1, 0.25, 0.5, 1.0]:
+        specifications.append(dict(
+            figure='potential', dataset_name='pima', n_minority_samples=1000, scaler='Standard',
+            parameters=dict(gamma=gamma), file_name=f'potential_{gamma}'
+        ))
+
+    for regions in ['L', 'E', 'H', 'LEH']:
+        specifications.append(dict(
+            figure='regions_placement', dataset_name='pima', n_minority_samples=20, scaler='MinMax',
+            parameters=dict(energy=0.5, gamma=0.25, regions=regions), file_name=f'regions_placement_{regions}'
+        ))
+
+    specifications.append(dict(
+        figure='regions_sphere', dataset_name='vehicle3', n_minority_samples=20, scaler='MinMax',
+        parameters=dict(energy=1.2, gamma=0.3), file_name='regions_sphere'
+    ))
+
+    return [specification for specification in specifications if name is None or specification['figure'] == name]
+
+
+def embed(dataset_name, n_minority_samples, scaler):
+    prepare_data(dataset_name, n_minority_samples=n_minority_samples, scaler=scaler)
+
+    return dataset_name, n_minority_samples, scaler
+
+
+def render(specification):
+    X, y = prepare_data(
+        specification['dataset_name'],
+        n_minority_samples=specification['n_minority_samples'],
+        scaler=specification['scaler']
+    )
+
+    kwargs = FIGURES[specification['figure']](X, y, **specification['parameters'])
+
+    visualize(file_name=specification['file_name'], **kwargs)
+
+    return specification['file_name']
+
+
+def render_all(specifications, n_workers=None):
+    embeddings = sorted(set((s['dataset_name'], s['n_minority_samples'], s['scaler']) for s in specifications))
+
+    with ProcessPoolExecutor(n_workers) as executor:
+        # every embedding is computed once, on the disk cache, before the figures that share it are rendered
+        for future in as_completed([executor.submit(embed, *embedding) for embedding in embeddings]):
+            logging.info(f'Embedded {future.result()}.')
+
+        for future in as_completed([executor.submit(render, specification) for specification in specifications]):
+            logging.info(f'Rendered {future.result()}.')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-figure', type=str, default=None, choices=list(FIGURES))
+    parser.add_argument('-n_workers', type=int, default=None)
+
+    args = parser.parse_args()
+
+    render_all(figures(args.figure), args.n_workers)
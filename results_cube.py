@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from collections import OrderedDict
+from functools import lru_cache
+from merge import RESULTS_PATH
+from results_store import ResultsStore
+
+
+def is_list(labels):
+    return isinstance(labels, (list, tuple, np.ndarray, pd.Index))
+
+
+class ResultsCube:
+    def __init__(self, df, value='Score'):
+        self.dimensions = [column for column in df.columns if column != value]
+        self.labels = {}
+
+        codes = []
+
+        for dimension in self.dimensions:
+            dimension_codes, uniques = pd.factorize(df[dimension])
+            codes.append(dimension_codes)
+            self.labels[dimension] = list(uniques)
+
+        self.positions = {dimension: {label: k for k, label in enumerate(self.labels[dimension])}
+                          for dimension in self.dimensions}
+
+        shape = tuple(len(self.labels[dimension]) for dimension in self.dimensions)
+        index = np.ravel_multi_index(codes, shape)
+
+        if len(np.unique(index)) != len(index):
+            raise ValueError('Results contain duplicate entries.')
+
+        # scores are kept in a dense array with one axis per dimension, missing entries being NaN, together with
+        # the row at which each entry was recorded
+        self.values = np.full(shape, np.nan)
+        self.values.flat[index] = df[value].values
+
+        self.rows = np.full(shape, np.iinfo(np.int64).max)
+        self.rows.flat[index] = np.arange(len(df))
+
+    def select(self, array=None, **selection):
+        array = self.values if array is None else array
+
+        # dimensions selected by a single label are dropped, dimensions selected by a list of labels are kept in
+        # the order of that list, and dimensions not mentioned are kept whole
+        for axis in reversed(range(len(self.dimensions))):
+            dimension = self.dimensions[axis]
+
+            if dimension not in selection:
+                continue
+
+            if is_list(selection[dimension]):
+                indices = [self.positions[dimension][label] for label in selection[dimension]]
+            else:
+                indices = self.positions[dimension][selection[dimension]]
+
+            array = np.take(array, indices, axis=axis)
+
+        return array
+
+    def first(self, dimension, **selection):
+        values, rows = self.select(**selection), self.select(self.rows, **selection)
+        axis = [d for d in self.dimensions if d not in selection or is_list(selection[d])].index(dimension)
+
+        # the entry recorded first along a dimension, as picked by filtering the raw results and taking the head
+        return np.take_along_axis(values, np.expand_dims(np.argmin(rows, axis=axis), axis), axis).squeeze(axis)
+
+
+@lru_cache(maxsize=None)
+def load_frame(trial='final'):
+    path = RESULTS_PATH / f'results_{trial}.csv'
+
+    # resampler names such as 'None' are labels, not missing values
+    if path.exists():
+        df = pd.read_csv(path, keep_default_na=False, na_values={'Score': ['', 'nan', 'NaN']})
+    else:
+        df = ResultsStore().read(trial)
+
+    if df is None:
+        raise FileNotFoundError(f'No results found for "{trial}" in {path} or the results store.')
+
+    for column in df.columns:
+        if column != 'Score' and not pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].astype('category')
+
+    return df
+
+
+@lru_cache(maxsize=None)
+def load_cube(trial='final'):
+    return ResultsCube(load_frame(trial))
+
+
+def fold_scores(classifier, metric, resamplers, datasets=None, trial='final'):
+    cube = load_cube(trial)
+
+    # by default datasets are ordered by their first appearance among the selected results
+    if datasets is None:
+        first_rows = cube.select(cube.rows, Classifier=classifier, Metric=metric).min(axis=(1, 2))
+        datasets = [cube.labels['Dataset'][k] for k in np.argsort(first_rows, kind='stable')
+                    if first_rows[k] < np.iinfo(np.int64).max]
+
+    scores = cube.select(Dataset=datasets, Classifier=classifier, Metric=metric, Resampler=resamplers)
+
+    assert scores.shape[1] == 10 and not np.any(np.isnan(scores)), 'Missing results.'
+
+    return scores
+
+
+def mean_scores(classifier, metric, resamplers, datasets=None, trial='final'):
+    means = np.mean(fold_scores(classifier, metric, resamplers, datasets, trial), axis=1)
+
+    return OrderedDict((resampler, list(means[:, k])) for k, resampler in enumerate(resamplers))
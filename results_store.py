@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+import sqlite3
+
+from contextlib import closing
+from pathlib import Path
+
+
+STORE_PATH = Path(__file__).parent / 'results.db'
+
+
+def python_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def trial_name(trial):
+    return '_'.join(str(value) for value in trial)
+
+
+class ResultsStore:
+    # WAL keeps readers and the writer from blocking each other, but its shared-memory index only works when
+    # every process using the database runs on the same host; stores written from several hosts, such as
+    # those of SLURM array workers, use journal_mode='DELETE', one file per worker, and are merged afterwards
+    def __init__(self, path=STORE_PATH, timeout=600.0, journal_mode='WAL'):
+        self.path = Path(path)
+        self.timeout = timeout
+        self.journal_mode = journal_mode
+
+    def connect(self):
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+
+        # isolation_level=None leaves transactions to the explicit BEGIN statements below
+        connection = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None)
+        connection.execute(f'PRAGMA journal_mode={self.journal_mode}')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS trials ('
+            'experiment TEXT, dataset TEXT, fold INTEGER, classifier TEXT, setting, '
+            'PRIMARY KEY (experiment, dataset, fold, classifier, setting))'
+        )
+
+        return connection
+
+    def write(self, experiment, trial, tables):
+        return self.write_many(experiment, [(trial, tables)]) == 1
+
+    def write_many(self, experiment, entries):
+        n_inserted = 0
+
+        if len(entries) == 0:
+            return n_inserted
+
+        with closing(self.connect()) as connection:
+            # every trial and all of its rows are written in one transaction, so a trial is either complete or
+            # absent, and a trial written twice by racing workers is kept only once
+            connection.execute('BEGIN IMMEDIATE')
+
+            try:
+                for trial, tables in entries:
+                    trial = tuple(python_value(value) for value in trial)
+                    inserted = connection.execute(
+                        'INSERT OR IGNORE INTO trials VALUES (?, ?, ?, ?, ?)', (experiment,) + trial
+                    ).rowcount
+
+                    if inserted == 1:
+                        for kind, df in tables.items():
+                            table = f'"{kind}_{experiment}"'
+                            columns = ', '.join(f'"{column}"' for column in df.columns)
+
+                            connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns})')
+                            connection.executemany(
+                                f'INSERT INTO {table} ({columns}) VALUES ({", ".join("?" * len(df.columns))})',
+                                [tuple(python_value(value) for value in row) for row in df.itertuples(index=False)]
+                            )
+
+                    n_inserted += inserted
+
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+
+                raise
+
+        return n_inserted
+
+    def exists(self, experiment, trial):
+        trial = tuple(python_value(value) for value in trial)
+
+        # reading never creates the database, so that looking up results does not leave an empty store behind
+        if not self.path.exists():
+            return False
+
+        with closing(self.connect()) as connection:
+            return connection.execute(
+                'SELECT 1 FROM trials WHERE experiment = ? AND dataset = ? AND fold = ? AND classifier = ? '
+                'AND setting = ?', (experiment,) + trial
+            ).fetchone() is not None
+
+    def completed(self, experiment):
+        if not self.path.exists():
+            return set()
+
+        with closing(self.connect()) as connection:
+            return set(connection.execute(
+                'SELECT dataset, fold, classifier, setting FROM trials WHERE experiment = ?', (experiment,)
+            ).fetchall())
+
+    def read(self, experiment, kind='results'):
+        if not self.path.exists():
+            return None
+
+        with closing(self.connect()) as connection:
+            table = f'{kind}_{experiment}'
+
+            if connection.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (table,)).fetchone() is None:
+                return None
+
+            return pd.read_sql_query(f'SELECT * FROM "{table}"', connection)
+
+    def merge(self, path):
+        with closing(self.connect()) as connection:
+            connection.execute('ATTACH DATABASE ? AS other', (str(path),))
+            connection.execute('BEGIN IMMEDIATE')
+
+            try:
+                tables = [row[0] for row in connection.execute(
+                    "SELECT name FROM other.sqlite_master WHERE type = 'table' AND name != 'trials'"
+                )]
+
+                # the first four columns of every table identify the trial of a row, so only the rows of trials
+                # missing from this store are copied
+                for table in tables:
+                    experiment = table.split('_', 1)[1]
+                    columns = [row[1] for row in connection.execute(f'PRAGMA other.table_info("{table}")')]
+                    quoted = ', '.join(f'"{column}"' for column in columns)
+                    keys = ' AND '.join(f'm.{name} = t."{column}"'
+                                        for name, column in zip(['dataset', 'fold', 'classifier', 'setting'], columns))
+
+                    connection.execute(f'CREATE TABLE IF NOT EXISTS main."{table}" ({quoted})')
+                    connection.execute(
+                        f'INSERT INTO main."{table}" ({quoted}) SELECT t.* FROM other."{table}" t WHERE NOT EXISTS '
+                        f'(SELECT 1 FROM main.trials m WHERE m.experiment = ? AND {keys})', (experiment,)
+                    )
+
+                n_inserted = connection.execute('INSERT OR IGNORE INTO main.trials SELECT * FROM other.trials').rowcount
+
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+
+                raise
+            finally:
+                connection.execute('DETACH DATABASE other')
+
+        return n_inserted
+
+    def import_csv(self, experiment, directory):
+        directory = Path(directory)
+
+        if not directory.exists():
+            return 0
+
+        # earlier versions of the experiments wrote every trial to its own CSV file, named after the trial
+        completed = {trial_name(trial) for trial in self.completed(experiment)}
+        entries = []
+
+        for path in sorted(directory.glob('*.csv')):
+            if path.stem in completed:
+                continue
+
+            df = pd.read_csv(path, keep_default_na=False, na_values={'Score': ['', 'nan', 'NaN']})
+
+            if len(df) > 0:
+                entries.append((tuple(df.iloc[0, :4]), {'results': df}))
+
+        return self.write_many(experiment, entries)
@@ -4,6 +4,7 @@ import logging
 import metrics
 import numpy as np
 import pandas as pd
+import telemetry
 
 from algorithm import RBCCR
 from cv import ResamplingCV
@@ -11,6 +12,7 @@ from imblearn.combine import SMOTEENN, SMOTETomek
 from imblearn.over_sampling import BorderlineSMOTE, SMOTE
 from imblearn.under_sampling import NeighbourhoodCleaningRule
 from pathlib import Path
+from results_store import ResultsStore
 from sklearn.linear_model import LogisticRegression
 from sklearn.naive_bayes import GaussianNB
 from sklearn.neighbors import KNeighborsClassifier
@@ -19,123 +21,153 @@ from sklearn.svm import LinearSVC, SVC
 from sklearn.tree import DecisionTreeClassifier
 
 
-def evaluate_trial(classifier_name, fold):
+EXPERIMENT = 'final'
+STORE = ResultsStore()
+# trials finished before the results store was introduced, one CSV file per trial
+LEGACY_RESULTS_PATH = Path(__file__).parent / 'results_final'
+RANDOM_STATE = 42
+
+CLASSIFIER_NAMES = ['CART', 'KNN', 'L-SVM', 'R-SVM', 'P-SVM', 'LR', 'NB', 'R-MLP', 'L-MLP']
+RESAMPLER_NAMES = ['None', 'SMOTE', 'Bord', 'NCL', 'SMOTE+TL', 'SMOTE+EN', 'CCR',
+                   'RB-CCR-H', 'RB-CCR-E', 'RB-CCR-L', 'RB-CCR-CV']
+
+
+def get_classifiers():
+    return {
+        'CART': DecisionTreeClassifier(random_state=RANDOM_STATE),
+        'KNN': KNeighborsClassifier(),
+        'L-SVM': LinearSVC(random_state=RANDOM_STATE),
+        'R-SVM': SVC(random_state=RANDOM_STATE, kernel='rbf'),
+        'P-SVM': SVC(random_state=RANDOM_STATE, kernel='poly'),
+        'LR': LogisticRegression(random_state=RANDOM_STATE),
+        'NB': GaussianNB(),
+        'R-MLP': MLPClassifier(random_state=RANDOM_STATE),
+        'L-MLP': MLPClassifier(random_state=RANDOM_STATE, activation='identity')
+    }
+
+
+def get_resamplers(classifier, n_jobs=None):
+    energies = [0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0]
+    gammas = [0.5, 1.0, 2.5, 5.0, 10.0]
+
+    return {
+        'None': None,
+        'SMOTE': ResamplingCV(
+            SMOTE, classifier,
+            k_neighbors=[1, 3, 5, 7, 9],
+            random_state=[RANDOM_STATE], seed=RANDOM_STATE, n_jobs=n_jobs
+        ),
+        'Bord': ResamplingCV(
+            BorderlineSMOTE, classifier,
+            k_neighbors=[1, 3, 5, 7, 9],
+            m_neighbors=[5, 10, 15],
+            random_state=[RANDOM_STATE], seed=RANDOM_STATE, n_jobs=n_jobs
+        ),
+        'NCL': ResamplingCV(
+            NeighbourhoodCleaningRule, classifier,
+            n_neighbors=[1, 3, 5, 7],
+            seed=RANDOM_STATE, n_jobs=n_jobs
+        ),
+        'SMOTE+TL': ResamplingCV(
+            SMOTETomek, classifier,
+            smote=[SMOTE(k_neighbors=k) for k in [1, 3, 5, 7, 9]],
+            random_state=[RANDOM_STATE], seed=RANDOM_STATE, n_jobs=n_jobs
+        ),
+        'SMOTE+EN': ResamplingCV(
+            SMOTEENN, classifier,
+            smote=[SMOTE(k_neighbors=k) for k in [1, 3, 5, 7, 9]],
+            random_state=[RANDOM_STATE], seed=RANDOM_STATE, n_jobs=n_jobs
+        ),
+        'CCR': ResamplingCV(
+            RBCCR, classifier, seed=RANDOM_STATE, n_jobs=n_jobs, energy=energies,
+            random_state=[RANDOM_STATE], gamma=[None]
+        ),
+        'RB-CCR-H': ResamplingCV(
+            RBCCR, classifier, seed=RANDOM_STATE, n_jobs=n_jobs, energy=energies,
+            random_state=[RANDOM_STATE], gamma=gammas, regions=['H']
+        ),
+        'RB-CCR-E': ResamplingCV(
+            RBCCR, classifier, seed=RANDOM_STATE, n_jobs=n_jobs, energy=energies,
+            random_state=[RANDOM_STATE], gamma=gammas, regions=['E']
+        ),
+        'RB-CCR-L': ResamplingCV(
+            RBCCR, classifier, seed=RANDOM_STATE, n_jobs=n_jobs, energy=energies,
+            random_state=[RANDOM_STATE], gamma=gammas, regions=['L']
+        ),
+        'RB-CCR-CV': ResamplingCV(
+            RBCCR, classifier, seed=RANDOM_STATE, n_jobs=n_jobs, energy=energies,
+            random_state=[RANDOM_STATE], gamma=gammas, regions=['L', 'E', 'H', 'LEH']
+        )
+    }
+
+
+def trials():
+    return [(dataset_name, fold, classifier_name, resampler_name)
+            for dataset_name in datasets.names() for fold in range(10)
+            for classifier_name in CLASSIFIER_NAMES for resampler_name in RESAMPLER_NAMES]
+
+
+def evaluate(dataset_name, fold, classifier_name, resampler_name, n_jobs=None):
+    trial_name = f'{dataset_name}_{fold}_{classifier_name}_{resampler_name}'
+    trial = (dataset_name, fold, classifier_name, resampler_name)
+
+    if STORE.exists(EXPERIMENT, trial):
+        return
+
+    logging.info(f'Evaluating {trial_name}...')
+
+    stopwatch = telemetry.Stopwatch()
+
+    dataset = datasets.load(dataset_name)
+
+    (X_train, y_train), (X_test, y_test) = dataset[fold][0], dataset[fold][1]
+
+    classifier = get_classifiers()[classifier_name]
+    resampler = get_resamplers(classifier, n_jobs)[resampler_name]
+
+    assert len(np.unique(y_train)) == len(np.unique(y_test)) == 2
+
+    training_set = (X_train, y_train)
+
+    if resampler is not None:
+        with stopwatch.measure('resampling'):
+            X_train, y_train = resampler.fit_sample(X_train, y_train)
+
+    with stopwatch.measure('fit'):
+        clf = classifier.fit(X_train, y_train)
+
+    with stopwatch.measure('predict'):
+        predictions = clf.predict(X_test)
+
+    scoring_functions = {
+        'Precision': metrics.precision,
+        'Recall': metrics.recall,
+        'Specificity': metrics.specificity,
+        'AUC': metrics.auc,
+        'G-mean': metrics.g_mean,
+        'F-measure': metrics.f_measure
+    }
+
+    rows = []
+
+    for scoring_function_name in scoring_functions.keys():
+        score = scoring_functions[scoring_function_name](y_test, predictions)
+        row = [dataset_name, fold, classifier_name, resampler_name, scoring_function_name, score]
+        rows.append(row)
+
+    columns = ['Dataset', 'Fold', 'Classifier', 'Resampler', 'Metric', 'Score']
+
+    measurements = telemetry.record(
+        dataset_name, fold, classifier_name, resampler_name, *training_set, resampler, stopwatch
+    )
+
+    STORE.write(EXPERIMENT, trial, {'results': pd.DataFrame(rows, columns=columns), 'telemetry': measurements})
+
+
+def evaluate_trial(classifier_name, fold, n_jobs=None):
     for dataset_name in datasets.names():
-        for resampler_name in ['None', 'SMOTE', 'Bord', 'NCL', 'SMOTE+TL', 'SMOTE+EN', 'CCR',
-                               'RB-CCR-H', 'RB-CCR-E', 'RB-CCR-L', 'RB-CCR-CV']:
-            RESULTS_PATH = Path(__file__).parents[0] / 'results_final'
-            RANDOM_STATE = 42
-
-            trial_name = f'{dataset_name}_{fold}_{classifier_name}_{resampler_name}'
-            trial_path = RESULTS_PATH / f'{trial_name}.csv'
-
-            if trial_path.exists():
-                continue
-
-            logging.info(f'Evaluating {trial_name}...')
-
-            dataset = datasets.load(dataset_name)
-
-            (X_train, y_train), (X_test, y_test) = dataset[fold][0], dataset[fold][1]
-
-            energies = [0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0]
-            gammas = [0.5, 1.0, 2.5, 5.0, 10.0]
-
-            classifiers = {
-                'CART': DecisionTreeClassifier(random_state=RANDOM_STATE),
-                'KNN': KNeighborsClassifier(),
-                'L-SVM': LinearSVC(random_state=RANDOM_STATE),
-                'R-SVM': SVC(random_state=RANDOM_STATE, kernel='rbf'),
-                'P-SVM': SVC(random_state=RANDOM_STATE, kernel='poly'),
-                'LR': LogisticRegression(random_state=RANDOM_STATE),
-                'NB': GaussianNB(),
-                'R-MLP': MLPClassifier(random_state=RANDOM_STATE),
-                'L-MLP': MLPClassifier(random_state=RANDOM_STATE, activation='identity')
-            }
-
-            classifier = classifiers[classifier_name]
-
-            resamplers = {
-                'None': None,
-                'SMOTE': ResamplingCV(
-                    SMOTE, classifier,
-                    k_neighbors=[1, 3, 5, 7, 9],
-                    random_state=[RANDOM_STATE], seed=RANDOM_STATE
-                ),
-                'Bord': ResamplingCV(
-                    BorderlineSMOTE, classifier,
-                    k_neighbors=[1, 3, 5, 7, 9],
-                    m_neighbors=[5, 10, 15],
-                    random_state=[RANDOM_STATE], seed=RANDOM_STATE
-                ),
-                'NCL': ResamplingCV(
-                    NeighbourhoodCleaningRule, classifier,
-                    n_neighbors=[1, 3, 5, 7],
-                    seed=RANDOM_STATE
-                ),
-                'SMOTE+TL': ResamplingCV(
-                    SMOTETomek, classifier,
-                    smote=[SMOTE(k_neighbors=k) for k in [1, 3, 5, 7, 9]],
-                    random_state=[RANDOM_STATE], seed=RANDOM_STATE
-                ),
-                'SMOTE+EN': ResamplingCV(
-                    SMOTEENN, classifier,
-                    smote=[SMOTE(k_neighbors=k) for k in [1, 3, 5, 7, 9]],
-                    random_state=[RANDOM_STATE], seed=RANDOM_STATE
-                ),
-                'CCR': ResamplingCV(
-                    RBCCR, classifier, seed=RANDOM_STATE, energy=energies,
-                    random_state=[RANDOM_STATE], gamma=[None]
-                ),
-                'RB-CCR-H': ResamplingCV(
-                    RBCCR, classifier, seed=RANDOM_STATE, energy=energies,
-                    random_state=[RANDOM_STATE], gamma=gammas, regions=['H']
-                ),
-                'RB-CCR-E': ResamplingCV(
-                    RBCCR, classifier, seed=RANDOM_STATE, energy=energies,
-                    random_state=[RANDOM_STATE], gamma=gammas, regions=['E']
-                ),
-                'RB-CCR-L': ResamplingCV(
-                    RBCCR, classifier, seed=RANDOM_STATE, energy=energies,
-                    random_state=[RANDOM_STATE], gamma=gammas, regions=['L']
-                ),
-                'RB-CCR-CV': ResamplingCV(
-                    RBCCR, classifier, seed=RANDOM_STATE, energy=energies,
-                    random_state=[RANDOM_STATE], gamma=gammas, regions=['L', 'E', 'H', 'LEH']
-                )
-            }
-
-            resampler = resamplers[resampler_name]
-
-            assert len(np.unique(y_train)) == len(np.unique(y_test)) == 2
-
-            if resampler is not None:
-                X_train, y_train = resampler.fit_sample(X_train, y_train)
-
-            clf = classifier.fit(X_train, y_train)
-            predictions = clf.predict(X_test)
-
-            scoring_functions = {
-                'Precision': metrics.precision,
-                'Recall': metrics.recall,
-                'Specificity': metrics.specificity,
-                'AUC': metrics.auc,
-                'G-mean': metrics.g_mean,
-                'F-measure': metrics.f_measure
-            }
-
-            rows = []
-
-            for scoring_function_name in scoring_functions.keys():
-                score = scoring_functions[scoring_function_name](y_test, predictions)
-                row = [dataset_name, fold, classifier_name, resampler_name, scoring_function_name, score]
-                rows.append(row)
-
-            columns = ['Dataset', 'Fold', 'Classifier', 'Resampler', 'Metric', 'Score']
-
-            RESULTS_PATH.mkdir(exist_ok=True, parents=True)
-
-            pd.DataFrame(rows, columns=columns).to_csv(trial_path, index=False)
+        for resampler_name in RESAMPLER_NAMES:
+            evaluate(dataset_name, fold, classifier_name, resampler_name, n_jobs)
 
 
 if __name__ == '__main__':
@@ -145,7 +177,10 @@ if __name__ == '__main__':
 
     parser.add_argument('-classifier_name', type=str)
     parser.add_argument('-fold', type=int)
+    parser.add_argument('-n_jobs', type=int, default=None)
 
     args = parser.parse_args()
 
-    evaluate_trial(args.classifier_name, args.fold)
+    STORE.import_csv(EXPERIMENT, LEGACY_RESULTS_PATH)
+
+    evaluate_trial(args.classifier_name, args.fold, args.n_jobs)
@@ -4,10 +4,12 @@ import logging
 import metrics
 import numpy as np
 import pandas as pd
+import telemetry
 
 from algorithm import RBCCR
 from cv import ResamplingCV
 from pathlib import Path
+from results_store import ResultsStore
 from sklearn.linear_model import LogisticRegression
 from sklearn.naive_bayes import GaussianNB
 from sklearn.neighbors import KNeighborsClassifier
@@ -16,73 +18,105 @@ from sklearn.svm import LinearSVC, SVC
 from sklearn.tree import DecisionTreeClassifier
 
 
-def evaluate_trial(classifier_name, fold, energy):
-    for dataset_name in datasets.names():
-        RESULTS_PATH = Path(__file__).parents[0] / 'results_preliminary_energy'
-        RANDOM_STATE = 42
+EXPERIMENT = 'preliminary_energy'
+STORE = ResultsStore()
+# trials finished before the results store was introduced, one CSV file per trial
+LEGACY_RESULTS_PATH = Path(__file__).parent / 'results_preliminary_energy'
+RANDOM_STATE = 42
 
-        trial_name = f'{dataset_name}_{fold}_{classifier_name}_{energy}'
-        trial_path = RESULTS_PATH / f'{trial_name}.csv'
+CLASSIFIER_NAMES = ['CART', 'KNN', 'L-SVM', 'R-SVM', 'P-SVM', 'LR', 'NB', 'R-MLP', 'L-MLP']
+ENERGIES = [0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0]
 
-        if trial_path.exists():
-            continue
 
-        logging.info(f'Evaluating {trial_name}...')
+def get_classifiers():
+    return {
+        'CART': DecisionTreeClassifier(random_state=RANDOM_STATE),
+        'KNN': KNeighborsClassifier(),
+        'L-SVM': LinearSVC(random_state=RANDOM_STATE),
+        'R-SVM': SVC(random_state=RANDOM_STATE, kernel='rbf'),
+        'P-SVM': SVC(random_state=RANDOM_STATE, kernel='poly'),
+        'LR': LogisticRegression(random_state=RANDOM_STATE),
+        'NB': GaussianNB(),
+        'R-MLP': MLPClassifier(random_state=RANDOM_STATE),
+        'L-MLP': MLPClassifier(random_state=RANDOM_STATE, activation='identity')
+    }
 
-        dataset = datasets.load(dataset_name)
 
-        (X_train, y_train), (X_test, y_test) = dataset[fold][0], dataset[fold][1]
+def get_resamplers(classifier, energy, n_jobs=None):
+    gammas = [0.5, 1.0, 2.5, 5.0, 10.0]
 
-        gammas = [0.5, 1.0, 2.5, 5.0, 10.0]
+    return {
+        'RB-CCR-CV': ResamplingCV(
+            RBCCR, classifier, seed=RANDOM_STATE, n_jobs=n_jobs, energy=[energy],
+            random_state=[RANDOM_STATE], gamma=gammas, regions=['L', 'E', 'H', 'LEH']
+        )
+    }
 
-        classifiers = {
-            'CART': DecisionTreeClassifier(random_state=RANDOM_STATE),
-            'KNN': KNeighborsClassifier(),
-            'L-SVM': LinearSVC(random_state=RANDOM_STATE),
-            'R-SVM': SVC(random_state=RANDOM_STATE, kernel='rbf'),
-            'P-SVM': SVC(random_state=RANDOM_STATE, kernel='poly'),
-            'LR': LogisticRegression(random_state=RANDOM_STATE),
-            'NB': GaussianNB(),
-            'R-MLP': MLPClassifier(random_state=RANDOM_STATE),
-            'L-MLP': MLPClassifier(random_state=RANDOM_STATE, activation='identity')
-        }
 
-        classifier = classifiers[classifier_name]
+def trials():
+    return [(dataset_name, fold, classifier_name, energy)
+            for dataset_name in datasets.names() for fold in range(10)
+            for classifier_name in CLASSIFIER_NAMES for energy in ENERGIES]
 
-        resampler = ResamplingCV(
-            RBCCR, classifier, seed=RANDOM_STATE, energy=[energy],
-            random_state=[RANDOM_STATE], gamma=gammas, regions=['L', 'E', 'H', 'LEH']
-        )
 
-        assert len(np.unique(y_train)) == len(np.unique(y_test)) == 2
+def evaluate(dataset_name, fold, classifier_name, energy, n_jobs=None):
+    trial_name = f'{dataset_name}_{fold}_{classifier_name}_{energy}'
+    trial = (dataset_name, fold, classifier_name, energy)
+
+    if STORE.exists(EXPERIMENT, trial):
+        return
+
+    logging.info(f'Evaluating {trial_name}...')
+
+    stopwatch = telemetry.Stopwatch()
+
+    dataset = datasets.load(dataset_name)
 
-        if resampler is not None:
+    (X_train, y_train), (X_test, y_test) = dataset[fold][0], dataset[fold][1]
+
+    classifier = get_classifiers()[classifier_name]
+    resampler = get_resamplers(classifier, energy, n_jobs)['RB-CCR-CV']
+
+    assert len(np.unique(y_train)) == len(np.unique(y_test)) == 2
+
+    training_set = (X_train, y_train)
+
+    if resampler is not None:
+        with stopwatch.measure('resampling'):
             X_train, y_train = resampler.fit_sample(X_train, y_train)
 
+    with stopwatch.measure('fit'):
         clf = classifier.fit(X_train, y_train)
+
+    with stopwatch.measure('predict'):
         predictions = clf.predict(X_test)
 
-        scoring_functions = {
-            'Precision': metrics.precision,
-            'Recall': metrics.recall,
-            'Specificity': metrics.specificity,
-            'AUC': metrics.auc,
-            'G-mean': metrics.g_mean,
-            'F-measure': metrics.f_measure
-        }
+    scoring_functions = {
+        'Precision': metrics.precision,
+        'Recall': metrics.recall,
+        'Specificity': metrics.specificity,
+        'AUC': metrics.auc,
+        'G-mean': metrics.g_mean,
+        'F-measure': metrics.f_measure
+    }
 
-        rows = []
+    rows = []
 
-        for scoring_function_name in scoring_functions.keys():
-            score = scoring_functions[scoring_function_name](y_test, predictions)
-            row = [dataset_name, fold, classifier_name, energy, scoring_function_name, score]
-            rows.append(row)
+    for scoring_function_name in scoring_functions.keys():
+        score = scoring_functions[scoring_function_name](y_test, predictions)
+        row = [dataset_name, fold, classifier_name, energy, scoring_function_name, score]
+        rows.append(row)
 
-        columns = ['Dataset', 'Fold', 'Classifier', 'Energy', 'Metric', 'Score']
+    columns = ['Dataset', 'Fold', 'Classifier', 'Energy', 'Metric', 'Score']
 
-        RESULTS_PATH.mkdir(exist_ok=True, parents=True)
+    measurements = telemetry.record(dataset_name, fold, classifier_name, energy, *training_set, resampler, stopwatch)
 
-        pd.DataFrame(rows, columns=columns).to_csv(trial_path, index=False)
+    STORE.write(EXPERIMENT, trial, {'results': pd.DataFrame(rows, columns=columns), 'telemetry': measurements})
+
+
+def evaluate_trial(classifier_name, fold, energy, n_jobs=None):
+    for dataset_name in datasets.names():
+        evaluate(dataset_name, fold, classifier_name, energy, n_jobs)
 
 
 if __name__ == '__main__':
@@ -93,7 +127,10 @@ if __name__ == '__main__':
     parser.add_argument('-classifier_name', type=str)
     parser.add_argument('-fold', type=int)
     parser.add_argument('-energy', type=float)
+    parser.add_argument('-n_jobs', type=int, default=None)
 
     args = parser.parse_args()
 
-    evaluate_trial(args.classifier_name, args.fold, args.energy)
+    STORE.import_csv(EXPERIMENT, LEGACY_RESULTS_PATH)
+
+    evaluate_trial(args.classifier_name, args.fold, args.energy, args.n_jobs)
@@ -0,0 +1,340 @@
+import argparse
+import datasets
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import run_final
+import run_preliminary_energy
+import shutil
+import socket
+import telemetry
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from results_store import ResultsStore, STORE_PATH, trial_name
+
+
+EXPERIMENTS = {
+    'final': run_final,
+    'preliminary_energy': run_preliminary_energy
+}
+
+# exponent of the number of samples in the fitting time of each classifier, used to rank trials until enough
+# telemetry has been recorded to fit a cost model
+CLASSIFIER_COMPLEXITIES = {
+    'CART': 1.0, 'KNN': 1.0, 'L-SVM': 1.5, 'R-SVM': 2.0, 'P-SVM': 2.0,
+    'LR': 1.0, 'NB': 1.0, 'R-MLP': 1.5, 'L-MLP': 1.5
+}
+
+
+def dataset_statistics(name):
+    path = os.path.join(datasets.DATA_PATH, '%s.dat' % name)
+
+    if not os.path.exists(path):
+        return 2, 1, 1.0
+
+    X, y = datasets.read_keel(path)
+
+    return X.shape[0], X.shape[1], telemetry.imbalance_ratio(y)
+
+
+def grid_size(experiment, trial):
+    module = EXPERIMENTS[experiment]
+    classifier = module.get_classifiers()[trial[2]]
+
+    if experiment == 'final':
+        resampler = module.get_resamplers(classifier)[trial[3]]
+    else:
+        resampler = module.get_resamplers(classifier, trial[3])['RB-CCR-CV']
+
+    return telemetry.grid_size(resampler)
+
+
+def load_history():
+    histories = [module.STORE.read(experiment, 'telemetry') for experiment, module in EXPERIMENTS.items()]
+    histories = [history for history in histories if history is not None]
+
+    if len(histories) == 0:
+        return None
+
+    return pd.concat(histories, ignore_index=True)
+
+
+def cost_model(history=None, min_trials=50):
+    history = load_history() if history is None else history
+
+    if history is None or len(history) < min_trials:
+        return None
+
+    return telemetry.CostModel(CLASSIFIER_COMPLEXITIES).fit(history)
+
+
+def expected_costs(experiment, trials, model=None):
+    statistics = {name: dataset_statistics(name) for name in set(trial[0] for trial in trials)}
+    grid_sizes = {key: grid_size(experiment, (None, None) + key) for key in set(trial[2:] for trial in trials)}
+
+    # trials are evaluated on one half of a dataset
+    n_samples = np.array([statistics[trial[0]][0] / 2 for trial in trials])
+    n_features = np.array([statistics[trial[0]][1] for trial in trials])
+    imbalance_ratios = np.array([statistics[trial[0]][2] for trial in trials])
+    sizes = np.array([grid_sizes[trial[2:]] for trial in trials])
+    classifier_names = [trial[2] for trial in trials]
+
+    if model is not None:
+        return model.predict(n_samples, n_features, imbalance_ratios, sizes, classifier_names)
+
+    # every combination of the grid is fitted on each of the six inner splits, then the selected one once more
+    exponents = np.array([CLASSIFIER_COMPLEXITIES[name] for name in classifier_names])
+
+    return (6 * sizes + 1) * n_features * n_samples ** exponents
+
+
+def tasks(experiment, model=None):
+    module = EXPERIMENTS[experiment]
+    completed = module.STORE.completed(experiment)
+    remaining = [trial for trial in module.trials() if trial not in completed]
+
+    if len(remaining) == 0:
+        return []
+
+    costs = expected_costs(experiment, remaining, cost_model() if model is None else model)
+
+    # the longest trials are started first, so that the last trials to finish are short ones
+    return [remaining[i] for i in np.argsort(-costs, kind='stable')]
+
+
+def run_task(experiment, trial, n_jobs=None):
+    EXPERIMENTS[experiment].evaluate(*trial, n_jobs=n_jobs)
+
+    return trial
+
+
+def import_legacy(experiment):
+    module = EXPERIMENTS[experiment]
+    n_imported = module.STORE.import_csv(experiment, module.LEGACY_RESULTS_PATH)
+
+    if n_imported > 0:
+        logging.info(f'Imported {n_imported} trials from {module.LEGACY_RESULTS_PATH}.')
+
+
+def run_local(experiment, n_workers=None, n_jobs=None):
+    import_legacy(experiment)
+    merge_worker_stores(experiment)
+
+    with ProcessPoolExecutor(n_workers) as executor:
+        futures = [executor.submit(run_task, experiment, trial, n_jobs) for trial in tasks(experiment)]
+
+        for future in as_completed(futures):
+            logging.info(f'Finished {future.result()}.')
+
+
+def locks_path(experiment):
+    return STORE_PATH.parent / 'locks' / experiment
+
+
+def lock_path(experiment, trial):
+    return locks_path(experiment) / (trial_name(trial) + '.lock')
+
+
+def done_path(experiment, trial):
+    return locks_path(experiment) / (trial_name(trial) + '.done')
+
+
+def workers_path(experiment):
+    return STORE_PATH.parent / 'workers' / experiment
+
+
+def queue_path(experiment):
+    return workers_path(experiment) / 'queue.json'
+
+
+def write_queue(experiment, trials):
+    path = queue_path(experiment)
+    path.parent.mkdir(exist_ok=True, parents=True)
+
+    temporary_path = path.with_suffix('.part')
+    temporary_path.write_text(json.dumps([list(trial) for trial in trials]))
+    os.replace(temporary_path, path)
+
+
+def read_queue(experiment):
+    return [tuple(trial) for trial in json.loads(queue_path(experiment).read_text())]
+
+
+def merge_worker_stores(experiment, unfinished=False):
+    paths = sorted((workers_path(experiment) / 'finished').glob('*.db'))
+
+    # stores of workers that did not finish may still be written to, so they are only merged on request
+    if unfinished:
+        paths += sorted(workers_path(experiment).glob('*.db'))
+
+    for path in paths:
+        n_inserted = EXPERIMENTS[experiment].STORE.merge(path)
+        path.unlink()
+
+        logging.info(f'Merged {n_inserted} trials from {path.name}.')
+
+
+def claim(experiment, trial):
+    path = lock_path(experiment, trial)
+    path.parent.mkdir(exist_ok=True, parents=True)
+
+    try:
+        handle = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+
+    with os.fdopen(handle, 'w') as f:
+        f.write(f'{socket.gethostname()} {os.getpid()}\n')
+
+    return True
+
+
+def run_worker(experiment, n_jobs=None):
+    module = EXPERIMENTS[experiment]
+    name = f'{socket.gethostname()}_{os.getpid()}.db'
+
+    # array tasks run on several hosts, so instead of the shared results store every worker writes its own
+    # store, in rollback journal mode, which the next submission merges into the shared one
+    module.STORE = ResultsStore(workers_path(experiment) / name, journal_mode='DELETE')
+
+    try:
+        # every array task walks the same ordered queue and claims trials with exclusively created lock files,
+        # so the trials are shared out dynamically without a coordinator; a finished trial keeps its lock as a
+        # done marker, checked after claiming since another worker may have finished it in the meantime
+        for trial in read_queue(experiment):
+            if done_path(experiment, trial).exists() or not claim(experiment, trial):
+                continue
+
+            if done_path(experiment, trial).exists():
+                lock_path(experiment, trial).unlink()
+
+                continue
+
+            try:
+                run_task(experiment, trial, n_jobs)
+            except Exception:
+                logging.exception(f'Trial {trial} failed.')
+                lock_path(experiment, trial).unlink()
+            else:
+                os.replace(lock_path(experiment, trial), done_path(experiment, trial))
+    finally:
+        if module.STORE.path.exists():
+            (workers_path(experiment) / 'finished').mkdir(exist_ok=True, parents=True)
+            os.replace(module.STORE.path, workers_path(experiment) / 'finished' / name)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+def is_stale(path, max_age=None):
+    try:
+        age = time.time() - path.stat().st_mtime
+        owner = path.read_text().split()
+    except FileNotFoundError:
+        return False
+
+    # a lock without an owner is either being written right now or was interrupted while being written
+    if len(owner) != 2:
+        return age > 60
+
+    host, pid = owner
+
+    # the owning process can only be checked on its own host; locks from other hosts expire after max_age
+    if host == socket.gethostname() and not is_alive(int(pid)):
+        return True
+
+    return max_age is not None and age > max_age
+
+
+def remove_stale_locks(experiment, max_age=None):
+    if not locks_path(experiment).exists():
+        return
+
+    for path in locks_path(experiment).glob('*.lock'):
+        if is_stale(path, max_age):
+            logging.info(f'Removing stale lock {path.name}.')
+
+            # Path.unlink(missing_ok=True) is not available on the Python 3.6 of the cluster
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def submit_array(experiment, n_workers, n_jobs=None, clear_locks=False, max_lock_age=None):
+    # locks of live workers are kept, so an array can be resubmitted while another one is still running;
+    # clear_locks removes every lock and merges the stores of unfinished workers, which is only safe when no
+    # worker of the experiment is alive
+    if clear_locks:
+        merge_worker_stores(experiment, unfinished=True)
+        shutil.rmtree(locks_path(experiment), ignore_errors=True)
+    else:
+        remove_stale_locks(experiment, max_lock_age)
+        merge_worker_stores(experiment)
+
+    import_legacy(experiment)
+
+    queue = tasks(experiment)
+
+    # a trial marked done by a worker whose store has not been merged, for example because the worker was
+    # killed afterwards, is run again; a duplicate result is discarded when the stores are merged
+    for trial in queue:
+        try:
+            done_path(experiment, trial).unlink()
+        except FileNotFoundError:
+            pass
+
+    write_queue(experiment, queue)
+
+    command = f'sbatch --array=0-{n_workers - 1} run.sh scheduler.py -mode worker -experiment {experiment}'
+
+    if n_jobs is not None:
+        command += f' -n_jobs {n_jobs}'
+
+    os.system(command)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-experiment', type=str, default='final', choices=list(EXPERIMENTS))
+    parser.add_argument('-mode', type=str, default='auto', choices=['auto', 'local', 'slurm', 'worker'])
+    parser.add_argument('-n_workers', type=int, default=None)
+    parser.add_argument('-n_jobs', type=int, default=None)
+    parser.add_argument('-clear_locks', action='store_true')
+    parser.add_argument('-max_lock_hours', type=float, default=None)
+
+    args = parser.parse_args()
+
+    mode = args.mode
+
+    if mode == 'auto':
+        if 'SLURM_ARRAY_TASK_ID' in os.environ:
+            mode = 'worker'
+        elif shutil.which('sbatch') is not None:
+            mode = 'slurm'
+        else:
+            mode = 'local'
+
+    if mode == 'local':
+        run_local(args.experiment, args.n_workers, args.n_jobs)
+    elif mode == 'slurm':
+        max_lock_age = None if args.max_lock_hours is None else args.max_lock_hours * 3600
+
+        submit_array(args.experiment, 90 if args.n_workers is None else args.n_workers, args.n_jobs,
+                     args.clear_locks, max_lock_age)
+    else:
+        run_worker(args.experiment, args.n_jobs)
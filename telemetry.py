@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+COLUMNS = ['Dataset', 'Fold', 'Classifier', 'Resampler', 'Samples', 'Features', 'ImbalanceRatio', 'GridSize',
+           'WallTime', 'ResamplingTime', 'FitTime', 'PredictTime', 'PeakRSS']
+
+
+class Stopwatch:
+    def __init__(self):
+        self.times = {}
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+def peak_rss():
+    if resource is None:
+        return np.nan
+
+    # ru_maxrss is reported in kilobytes on linux; it is the peak of the whole process, so for a worker
+    # running several trials it is an upper bound for the later ones
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def grid_size(resampler):
+    if resampler is None:
+        return 0
+
+    return int(np.prod([len(values) for values in resampler.kwargs.values()]))
+
+
+def imbalance_ratio(y):
+    counts = np.unique(y, return_counts=True)[1]
+
+    return counts.max() / counts.min()
+
+
+def record(dataset_name, fold, classifier_name, resampler_name, X, y, resampler, stopwatch):
+    row = [dataset_name, fold, classifier_name, resampler_name, X.shape[0], X.shape[1], imbalance_ratio(y),
+           grid_size(resampler), stopwatch.elapsed(), stopwatch.times.get('resampling', 0.0),
+           stopwatch.times.get('fit', 0.0), stopwatch.times.get('predict', 0.0), peak_rss()]
+
+    return pd.DataFrame([row], columns=COLUMNS)
+
+
+class CostModel:
+    def __init__(self, classifier_names):
+        self.classifier_names = list(classifier_names)
+        self.coefficients = None
+
+    def features(self, n_samples, n_features, imbalance_ratio, grid_size, classifier_names):
+        n_samples, n_features = np.asarray(n_samples, dtype=float), np.asarray(n_features, dtype=float)
+        imbalance_ratio, grid_size = np.asarray(imbalance_ratio, dtype=float), np.asarray(grid_size, dtype=float)
+
+        # runtime is modelled as a power law of every size, with a separate factor per classifier, which is
+        # linear in the logarithms
+        columns = [np.log(n_samples), np.log(n_features), np.log(imbalance_ratio), np.log1p(grid_size)]
+        columns += [np.asarray(classifier_names) == name for name in self.classifier_names]
+
+        return np.column_stack(columns).astype(float)
+
+    def fit(self, history):
+        X = self.features(history['Samples'], history['Features'], history['ImbalanceRatio'],
+                          history['GridSize'], history['Classifier'])
+        y = np.log(np.maximum(history['WallTime'].values.astype(float), 1e-3))
+
+        self.coefficients = np.linalg.lstsq(X, y, rcond=None)[0]
+
+        return self
+
+    def predict(self, n_samples, n_features, imbalance_ratio, grid_size, classifier_names):
+        if self.coefficients is None:
+            raise RuntimeError('Cost model has not been fitted.')
+
+        return np.exp(self.features(n_samples, n_features, imbalance_ratio, grid_size, classifier_names) @
+                      self.coefficients)
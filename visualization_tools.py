@@ -1,11 +1,14 @@
 import datasets
 import matplotlib.pyplot as plt
 import numpy as np
+import os
+import tempfile
 
-from algorithm import distance, rbf_score
+from algorithm import rbf_score, rbf_scores
 from collections import Counter
 from imblearn.under_sampling import RandomUnderSampler
 from matplotlib.patches import Polygon
+from pathlib import Path
 from scipy.spatial import ConvexHull
 from sklearn.manifold import TSNE
 from sklearn.preprocessing import MinMaxScaler, StandardScaler
@@ -30,6 +33,41 @@ REGIONS_COLORS = ['red', 'yellow', 'green']
 REGIONS_STEPS = 1000
 REGIONS_THRESHOLD = 0.33
 
+EMBEDDINGS_PATH = Path(datasets.CACHE_PATH) / 'embeddings'
+
+
+def potential_grid(x_limits, y_limits, minority_points, gamma, p_norm=2):
+    x_cont = np.linspace(x_limits[0], x_limits[1], POTENTIAL_GRID_N + 1)
+    y_cont = np.linspace(y_limits[0], y_limits[1], POTENTIAL_GRID_N + 1)
+
+    X_cont, Y_cont = np.meshgrid(x_cont, y_cont)
+
+    Z = rbf_scores(np.column_stack([X_cont.ravel(), Y_cont.ravel()]), minority_points, gamma, p_norm)
+
+    return X_cont, Y_cont, Z.reshape(X_cont.shape)
+
+
+def regions_grid(center, radius, minority_points, gamma, p_norm=2):
+    seed_score = rbf_score(center, minority_points, gamma, p_norm)
+
+    x_steps = np.linspace(center[0] - radius, center[0] + radius, REGIONS_STEPS)
+    y_steps = np.linspace(center[1] - radius, center[1] + radius, REGIONS_STEPS)
+
+    # 'ij' indexing visits the grid in the same x-major order as a nested loop over the two axes, and the
+    # disc test keeps the euclidean distance of algorithm.distance() regardless of p_norm
+    points = np.stack(np.meshgrid(x_steps, y_steps, indexing='ij'), axis=-1).reshape(-1, 2)
+    points = points[np.power(np.sum(np.abs(points - center) ** 2, axis=1), 1 / 2) <= radius]
+
+    scores = rbf_scores(points, minority_points, gamma, p_norm)
+
+    lower_threshold = seed_score - REGIONS_THRESHOLD * (seed_score - np.min(np.append(scores, seed_score)))
+    higher_threshold = seed_score + REGIONS_THRESHOLD * (np.max(np.append(scores, seed_score)) - seed_score)
+
+    lower = scores <= lower_threshold
+    higher = ~lower & (scores >= higher_threshold)
+
+    return points[lower], points[~lower & ~higher], points[higher]
+
 
 def visualize(X, y, appended=None, gamma=None, radii=None,
               regions_center=None, regions_radius=None,
@@ -80,33 +118,7 @@ def visualize(X, y, appended=None, gamma=None, radii=None,
         plt.ylim(lim)
 
     if regions_center is not None and regions_radius is not None and gamma is not None:
-        seed_score = rbf_score(regions_center, minority_points, gamma, p_norm)
-
-        l_points = []
-        e_points = []
-        h_points = []
-
-        pp = []
-        scores = []
-
-        for x_i in np.linspace(regions_center[0] - regions_radius, regions_center[0] + regions_radius, REGIONS_STEPS):
-            for y_i in np.linspace(regions_center[1] - regions_radius, regions_center[1] + regions_radius, REGIONS_STEPS):
-                p_i = np.array([x_i, y_i])
-
-                if distance(p_i, regions_center) <= regions_radius:
-                    pp.append(p_i)
-                    scores.append(rbf_score(p_i, minority_points, gamma, p_norm))
-
-        lower_threshold = seed_score - REGIONS_THRESHOLD * (seed_score - np.min(scores + [seed_score]))
-        higher_threshold = seed_score + REGIONS_THRESHOLD * (np.max(scores + [seed_score]) - seed_score)
-
-        for sample, score in zip(pp, scores):
-            if score <= lower_threshold:
-                l_points.append(sample)
-            elif score >= higher_threshold:
-                h_points.append(sample)
-            else:
-                e_points.append(sample)
+        l_points, e_points, h_points = regions_grid(regions_center, regions_radius, minority_points, gamma, p_norm)
 
         for region_points, color in zip([l_points, e_points, h_points], REGIONS_COLORS):
             pp = np.array(region_points)
@@ -161,21 +173,7 @@ def visualize(X, y, appended=None, gamma=None, radii=None,
         )
 
     if gamma is not None:
-        x_cont = np.linspace(x_limits[0], x_limits[1], POTENTIAL_GRID_N + 1)
-        y_cont = np.linspace(y_limits[0], y_limits[1], POTENTIAL_GRID_N + 1)
-
-        X_cont, Y_cont = np.meshgrid(x_cont, y_cont)
-
-        Z = np.zeros(X_cont.shape)
-
-        for i, x1 in enumerate(x_cont):
-            for j, x2 in enumerate(y_cont):
-                Z[j][i] = rbf_score(
-                    np.array([x1, x2]),
-                    minority_points,
-                    gamma,
-                    p_norm
-                )
+        X_cont, Y_cont, Z = potential_grid(x_limits, y_limits, minority_points, gamma, p_norm)
 
         plt.contour(X_cont, Y_cont, Z)
 
@@ -188,8 +186,21 @@ def visualize(X, y, appended=None, gamma=None, radii=None,
         plt.show()
 
 
-def prepare_data(dataset_name, n_minority_samples=20, scaler='MinMax'):
+def embedding_path(dataset_name, n_minority_samples, scaler):
+    # embeddings are keyed by the contents of the dataset as well as by the arguments, so they are recomputed
+    # whenever the underlying data or its partitions change
+    return EMBEDDINGS_PATH / f'{datasets.cache_key(dataset_name)}-{n_minority_samples}-{scaler}.npz'
+
+
+def prepare_data(dataset_name, n_minority_samples=20, scaler='MinMax', cache=True):
+    path = embedding_path(dataset_name, n_minority_samples, scaler)
+
+    if cache and path.exists():
+        with np.load(path) as f:
+            return f['X'], f['y']
+
     dataset = datasets.load(dataset_name)
+
     (X_train, y_train), (X_test, y_test) = dataset[0][0], dataset[0][1]
     X, y = np.concatenate([X_train, X_test]), np.concatenate([y_train, y_test])
 
@@ -216,4 +227,17 @@ def prepare_data(dataset_name, n_minority_samples=20, scaler='MinMax'):
     else:
         raise NotImplementedError
 
+    if cache:
+        # the key is computed again, since loading the dataset may have just written its partitions, which it covers
+        path = embedding_path(dataset_name, n_minority_samples, scaler)
+
+        EMBEDDINGS_PATH.mkdir(exist_ok=True, parents=True)
+
+        handle, temporary_path = tempfile.mkstemp(dir=EMBEDDINGS_PATH, suffix='.npz')
+
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, X=X, y=y)
+
+        os.replace(temporary_path, path)
+
     return X, y